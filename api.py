@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta
+
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+
+import clock
+from models import Venue, Artist
+from queries import ENTITY_FIELDS, entity_page, venue_detail, artist_detail, show_page, show_detail
+from scheduling import free_slots
+from serializers import dumps
+from exporter import EXPORTS, iter_records, iter_csv, iter_ndjson
+
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# most ids a single ?ids= bulk fetch may ask for
+MAX_BULK_IDS = 100
+
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def json_response(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def select_fields(data, allowed):
+    """Apply ?fields=a,b to one dict (or each dict of a list)."""
+    fields = request.args.get('fields')
+    if not fields:
+        return data
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if any(field not in allowed for field in fields):
+        abort(400)
+    if isinstance(data, list):
+        return [{field: item[field] for field in fields} for item in data]
+    return {field: data[field] for field in fields}
+
+
+def requested_fields(model):
+    fields = request.args.get('fields')
+    if not fields:
+        return ENTITY_FIELDS[model]
+    fields = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    if any(field not in ENTITY_FIELDS[model] for field in fields):
+        abort(400)
+    return fields
+
+
+def requested_ids():
+    ids = request.args.get('ids')
+    if ids is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(id) for id in ids.split(',') if id.strip()))
+    except ValueError:
+        abort(400)
+    if len(ids) > MAX_BULK_IDS:
+        abort(400)
+    return ids
+
+
+def requested_limit():
+    try:
+        limit = int(request.args.get('limit', current_app.config['SHOWS_PER_PAGE']))
+    except ValueError:
+        abort(400)
+    return max(1, min(limit, MAX_BULK_IDS))
+
+
+def entity_list(model):
+    ids = requested_ids()
+    try:
+        after = int(request.args['after']) if 'after' in request.args else None
+    except ValueError:
+        abort(400)
+    data, next_cursor = entity_page(
+        model,
+        requested_fields(model),
+        ids=ids,
+        after=after,
+        limit=len(ids) if ids is not None else requested_limit(),
+        genre=request.args.get('genre'),
+    )
+    return json_response({'data': data, 'next_cursor': next_cursor})
+
+
+def entity(data):
+    if data is None:
+        abort(404)
+    return json_response(select_fields(data, data.keys()))
+
+
+#----------------------------------------------------------------------------#
+# Endpoints.
+#----------------------------------------------------------------------------#
+
+@api.route('/venues')
+def venues():
+    return entity_list(Venue)
+
+
+@api.route('/venues/<int:venue_id>')
+def venue(venue_id):
+    return entity(venue_detail(venue_id))
+
+
+@api.route('/venues/<int:venue_id>/free-slots')
+def venue_free_slots(venue_id):
+    # ?week=2026-W43 (ISO week, default this week) and ?min_minutes= to skip short gaps
+    if Venue.query.filter(Venue.id == venue_id).count() == 0:
+        abort(404)
+    try:
+        if 'week' in request.args:
+            week_start = datetime.strptime(request.args['week'] + '-1', '%G-W%V-%u')
+        else:
+            today = clock.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            week_start = today - timedelta(days=today.weekday())
+        min_length = timedelta(minutes=int(request.args.get('min_minutes', 0)))
+    except ValueError:
+        abort(400)
+    slots = free_slots(venue_id, week_start, min_length)
+    return json_response({
+        'venue_id': venue_id,
+        'week_start': week_start,
+        'week_end': week_start + timedelta(days=7),
+        'free': [{'start': start, 'end': end} for start, end in slots],
+    })
+
+
+@api.route('/artists')
+def artists():
+    return entity_list(Artist)
+
+
+@api.route('/artists/<int:artist_id>')
+def artist(artist_id):
+    return entity(artist_detail(artist_id))
+
+
+@api.route('/shows')
+def shows():
+    when = request.args.get('when', 'all')
+    if when not in ('all', 'upcoming', 'past'):
+        abort(400)
+    try:
+        data, next_cursor = show_page(when, after=request.args.get('after'), limit=requested_limit())
+    except ValueError:
+        abort(400)
+    if data:
+        data = select_fields(data, data[0].keys())
+    return json_response({'data': data, 'next_cursor': next_cursor})
+
+
+@api.route('/shows/<int:show_id>')
+def show(show_id):
+    return entity(show_detail(show_id))
+
+
+@api.route('/export/<kind>')
+def export(kind):
+    # streamed dumps for analytics: ?format=csv|ndjson and ?since=<ISO time> for increments
+    if kind not in EXPORTS:
+        abort(404)
+    format = request.args.get('format', 'csv')
+    if format not in ('csv', 'ndjson'):
+        abort(400)
+    try:
+        since = datetime.fromisoformat(request.args['since']) if 'since' in request.args else None
+    except ValueError:
+        abort(400)
+
+    records = iter_records(kind, since=since)
+    if format == 'csv':
+        body, mimetype = iter_csv(kind, records), 'text/csv'
+    else:
+        body, mimetype = iter_ndjson(records), 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}s.{format}'
+    return response
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def error(error):
+    return json_response({'error': error.code, 'message': error.description}, status=error.code)
@@ -1,7 +1,10 @@
 import sys
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify
+import babel.dates
+from babel import Locale
+from flask import Flask, render_template, stream_template, request, Response, flash, redirect, url_for, abort, jsonify
 from flask_moment import Moment
 import logging
 from logging import Formatter, FileHandler
@@ -9,24 +12,66 @@ from flask_wtf import Form
 from forms import *
 
 
-from models import setup_db, Venue, Artist, Show, db
+from config import SQLALCHEMY_DATABASE_URI
+from assets import setup_assets
+from images import setup_images
+from models import setup_db, touch, Venue, Artist, Show, db, DEFAULT_SHOW_DURATION
+from clock import setup_clock
+from search import setup_search, search
+from counters import record_show, delete_venue_shows
+from scheduling import booking_conflict, book_tour
+from sqlalchemy.exc import IntegrityError
+from cli import fyyur_cli
+from cache import cache, conditional, setup_cache
+from api import api
+from instrumentation import setup_instrumentation
+from metrics import setup_metrics
+from queries import venue_areas, artist_list, venue_detail, artist_detail, show_page, iter_shows
 
 
-def create_app():
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=None)
+def _datetime_pattern(format, locale):
+    # Babel re-parses pattern strings on every format_datetime() call; parse each one once
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), Locale.parse(locale)
+
+
+@lru_cache(maxsize=4096)
+def _format_datetime(value, format, locale):
+    pattern, locale = _datetime_pattern(format, locale)
+    if value.tzinfo is None:
+        # what babel.dates.format_datetime() assumes for naive datetimes
+        value = value.replace(tzinfo=timezone.utc)
+    return pattern.apply(value, locale)
+
+
+def create_app(db_uri=SQLALCHEMY_DATABASE_URI, replica_uris=None, clock=None):
     app = Flask(__name__)
-    setup_db(app)
+    setup_db(app, db_uri, replica_uris)
+    setup_clock(app, clock)
+    setup_instrumentation(app)
+    setup_search(app)
+    setup_cache(app)
+    setup_metrics(app, db)
+    setup_assets(app)
+    setup_images(app)
+    app.cli.add_command(fyyur_cli)
+    app.register_blueprint(api)
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
     def format_datetime(value, format='medium'):
-        date = dateutil.parser.parse(value)
-        if format == 'full':
-            format="EEEE MMMM, d, y 'at' h:mma"
-        elif format == 'medium':
-            format="EE MM, dd, y h:mma"
-        return babel.dates.format_datetime(date, format, locale='en')
+        # views pass datetimes straight through; strings are still accepted
+        if not isinstance(value, datetime):
+            value = dateutil.parser.parse(value)
+        return _format_datetime(value, format, 'en')
 
     app.jinja_env.filters['datetime'] = format_datetime
 
@@ -43,93 +88,42 @@ def create_app():
 #  ----------------------------------------------------------------
 
     @app.route('/venues')
+    @cache.cached('venues')
     def venues():
-        venues = Venue.query.distinct(Venue.city).all()
-        
-        # TODO: replace with real venues data.
-        #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-        data = []
-        for venue in venues:
-            vens = []
-            data.append({
-                "city": venue.city,
-                "state": venue.state,
-                "venues": vens
-            })
-            city_venues = Venue.query.filter(Venue.city==venue.city, Venue.state==venue.state).all()
-            for v in city_venues:
-                vens.append({
-                    "id": v.id,
-                    "name": v.name,
-                    "num_upcoming_shows": Show.query.filter(Show.start_time >= datetime.now()).count(),
-                })
-    
-        return render_template('pages/venues.html', areas=data);
+        # areas, venues and their upcoming show counts come back from one grouped query
+        genre = request.args.get('genre')
+        data = venue_areas(genre=genre)
+        return render_template('pages/venues.html', areas=data, genre=genre)
 
     @app.route('/venues/search', methods=['POST'])
     def search_venues():
         search_term = request.form['search_term']
-        venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%'))
-        
-        # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+        # ranked matches and their total count come back from one query
+        venues, count = search(Venue, search_term)
+
         # seach for Hop should return "The Musical Hop".
         # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
         data = []
-        for venue in venues.all():
+        for venue in venues:
             data.append({
             "id": venue.id,
             "name": venue.name,
-            "num_upcoming_shows": Venue.query.filter(Venue.id==venue.id, Show.start_time >= datetime.now()),
+            "num_upcoming_shows": venue.upcoming_shows_count,
             })
         response={
-            "count": venues.count(),
+            "count": count,
             "data": data
         }
         return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
     @app.route('/venues/<int:venue_id>')
+    @conditional(Venue, 'venue_id')
+    @cache.cached('venue', 'venue_id')
     def show_venue(venue_id):
         # shows the venue page with the given venue_id
-        # TODO: replace with real venue data from the venues table, using venue_id
-        venue = Venue.query.get(venue_id)
-
-        upcoming_sql = Show.query.filter(Show.start_time >= datetime.now(), Show.venue_id==venue.id)
-        upcoming_show = []
-        for show in upcoming_sql.all():
-            upcoming_show.append({
-                "venue_id": show.venue_id,
-                "artist_name": show.artist.name,
-                "artist_image_link": show.artist.image_link,
-                "start_time": str(show.start_time)
-            })
-
-        past_sql = Show.query.filter(Show.start_time < datetime.now(), Show.venue_id == venue.id)
-        past_shows = []
-        for show in past_sql.all():
-            past_shows.append({
-            "artist_id": show.artist_id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": str(show.start_time)
-            })
-        data={
-            "id": venue.id,
-            "name": venue.name,
-            "genres": venue.genres.replace('{','').replace('}', '').split(','),
-            "address": venue.address,
-            "city": venue.city,
-            "state": venue.state,
-            "phone": venue.phone,
-            "website_link": venue.website_link,
-            "facebook_link": venue.facebook_link,
-            "seeking_talent": venue.seeking_talent,
-            "seeking_description": venue.seeking_description,
-            "image_link": venue.image_link,
-            "past_shows": past_shows,
-            "upcoming_shows": upcoming_show,
-            "past_shows_count": past_sql.count(),
-            "upcoming_shows_count": upcoming_sql.count(),
-        }
+        data = venue_detail(venue_id)
+        if data is None:
+            abort(404)
         return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
@@ -161,6 +155,7 @@ def create_app():
                 )
                 db.session.add(venue)
                 db.session.commit()
+                cache.invalidate(('venues',))
                 flash('Venue ' + request.form['name'] + ' was successfully listed!')
             except:
                 db.session.rollback()
@@ -177,8 +172,11 @@ def create_app():
     def delete_venue(venue_id):
         error = False
         try:
+            artist_ids = [id for id, in db.session.query(Show.artist_id).filter(Show.venue_id==venue_id).distinct()]
+            delete_venue_shows(venue_id)
             Venue.query.filter(Venue.id==venue_id).delete()
             db.session.commit()
+            cache.invalidate(('venue', venue_id), ('venues',), ('shows',), *(('artist', id) for id in artist_ids))
         except:
             db.session.rollback()
             error = True
@@ -196,80 +194,39 @@ def create_app():
 #  Artists
 #  ----------------------------------------------------------------
     @app.route('/artists')
+    @cache.cached('artists')
     def artists():
-        artists = Artist.query.all()
-        # TODO: replace with real data returned from querying the database
-        data=[]
-        for artist in artists:
-            data.append({
-            "id": artist.id,
-            "name": artist.name,
-        })
-        return render_template('pages/artists.html', artists=data)
+        genre = request.args.get('genre')
+        data = artist_list(genre=genre)
+        return render_template('pages/artists.html', artists=data, genre=genre)
 
     @app.route('/artists/search', methods=['POST'])
     def search_artists():
-    # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
         search_term = request.form['search_term']
-        artists = Artist.query.filter(Artist.name.ilike(f"%{search_term}%"))
+        artists, count = search(Artist, search_term)
         data = []
-        for artist in artists.all():
+        for artist in artists:
             data.append({
             "id": artist.id,
             "name": artist.name,
-            "num_upcoming_shows": Show.query.filter(Show.artist_id==artist.id, Show.start_time >= datetime.now()).count(),
+            "num_upcoming_shows": artist.upcoming_shows_count,
             })
         response={
-            "count": artists.count(),
+            "count": count,
             "data": data
         }
         return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
     @app.route('/artists/<int:artist_id>')
+    @conditional(Artist, 'artist_id')
+    @cache.cached('artist', 'artist_id')
     def show_artist(artist_id):
         # shows the artist page with the given artist_id
-        # TODO: replace with real artist data from the artist table, using artist_id
-        artist = Artist.query.get(artist_id)
-        genres =  artist.genres.replace('{', '').replace('}', '').split(',')
-
-        past_shows_query = Show.query.filter(Show.start_time < datetime.now(), Show.artist_id==artist_id)
-        past_shows = []
-        for show in past_shows_query.all():
-            past_shows.append({
-                "venue_id": show.venue.id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": str(show.start_time)
-            })
-
-        upcoming_query = Show.query.filter(Show.start_time>=datetime.now(), Show.artist_id==artist_id)
-        upcoming_shows = []
-        for show in upcoming_query.all():
-            upcoming_shows.append({
-                "venue_id": show.venue_id,
-                "venue_name": show.venue.name,
-                "venue_image_link": show.venue.image_link,
-                "start_time": str(show.start_time),
-            })
-        data={
-            "id": artist.id,
-            "name": artist.name,
-            "genres": genres,
-            "city": artist.city,
-            "state": artist.state,
-            "phone": artist.phone,
-            "website": artist.website_link,
-            "facebook_link": artist.facebook_link,
-            "seeking_venue": artist.seeking_venue,
-            "seeking_description": artist.seeking_description,
-            "image_link": artist.image_link,
-            "past_shows": past_shows,
-            "upcoming_shows": upcoming_shows,
-            "past_shows_count": past_shows_query.count(),
-            "upcoming_shows_count": upcoming_query.count(),
-        }
+        data = artist_detail(artist_id)
+        if data is None:
+            abort(404)
         return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -310,7 +267,11 @@ def create_app():
                 artist.seeking_venue = form.seeking_venue.data
                 artist.seeking_description = form.seeking_description.data
                 artist.image_link = form.image_link.data
+                # the artist's name and image also appear on /shows and on the pages of its venues
+                venue_ids = [id for id, in db.session.query(Show.venue_id).filter(Show.artist_id==artist_id).distinct()]
+                touch(Venue, venue_ids)
                 db.session.commit()
+                cache.invalidate(('artist', artist_id), ('artists',), ('shows',), *(('venue', id) for id in venue_ids))
             except:
                 db.session.rollback()
                 error = True
@@ -363,7 +324,11 @@ def create_app():
                 venue.seeking_talent = form.seeking_talent.data
                 venue.seeking_description = form.seeking_description.data
                 venue.image_link = form.image_link.data
+                # the venue's name and image also appear on /shows and on the pages of its artists
+                artist_ids = [id for id, in db.session.query(Show.artist_id).filter(Show.venue_id==venue_id).distinct()]
+                touch(Artist, artist_ids)
                 db.session.commit()
+                cache.invalidate(('venue', venue_id), ('venues',), ('shows',), *(('artist', id) for id in artist_ids))
             except:
                 db.session.rollback()
                 error = True
@@ -405,6 +370,7 @@ def create_app():
                 )
                 db.session.add(artist)
                 db.session.commit()
+                cache.invalidate(('artists',))
                 flash('Artist ' + request.form['name'] + ' was successfully listed!')
             except:
                 db.session.rollback()
@@ -427,22 +393,27 @@ def create_app():
 #  ----------------------------------------------------------------
 
     @app.route('/shows')
+    @cache.cached('shows')
     def shows():
-    # displays list of shows at /shows
-    # TODO: replace with real venues data.
-        shows = Show.query.all()
-        data=[]
-        for show in shows:
-            data.append({
-            "venue_id": show.venue.id,
-            "venue_name": show.venue.name,
-            "artist_id": show.artist.id,
-            "artist_name": show.artist.name,
-            "artist_image_link": show.artist.image_link,
-            "start_time": str(show.start_time)
-        })
-        print(data)
-        return render_template('pages/shows.html', shows=data)
+        # displays list of shows at /shows
+        # ?when=upcoming|past narrows the feed, ?after=<cursor> walks it page by page
+        # and ?stream=1 streams the whole feed instead of paginating it
+        when = request.args.get('when', 'all')
+        if when not in ('all', 'upcoming', 'past'):
+            abort(400)
+
+        if request.args.get('stream'):
+            return Response(stream_template('pages/shows.html', shows=iter_shows(when), when=when))
+
+        try:
+            data, next_cursor = show_page(
+                when,
+                after=request.args.get('after'),
+                limit=app.config['SHOWS_PER_PAGE'],
+            )
+        except ValueError:
+            abort(400)
+        return render_template('pages/shows.html', shows=data, when=when, next_cursor=next_cursor)
 
     @app.route('/shows/create')
     def create_shows():
@@ -456,21 +427,50 @@ def create_app():
         # TODO: insert form data as a new Show record in the db, instead
         form = ShowForm(request.form)
         if request.method == 'POST' and form.validate():
+            # both ids in one query, so a missing one is a form error rather than a foreign key failure
+            venue_id, artist_id = (int(id) if id.isdigit() else None
+                                   for id in ((form.venue_id.data or '').strip(), (form.artist_id.data or '').strip()))
+            venue_known, artist_known = db.session.query(
+                db.session.query(Venue.id).filter(Venue.id == venue_id).exists(),
+                db.session.query(Artist.id).filter(Artist.id == artist_id).exists(),
+            ).one()
+            if not venue_known:
+                form.venue_id.errors.append('No such venue.')
+            if not artist_known:
+                form.artist_id.errors.append('No such artist.')
+            if not (venue_known and artist_known):
+                return render_template('forms/new_show.html', form=form), 400
+
             error = False
             try:
                 show = Show(
-                    venue_id = form.venue_id.data,
-                    artist_id = form.artist_id.data,
+                    venue_id = venue_id,
+                    artist_id = artist_id,
                     start_time = form.start_time.data,
+                    end_time = form.start_time.data + (timedelta(minutes=form.duration.data) if form.duration.data
+                                                       else DEFAULT_SHOW_DURATION),
                 )
                 db.session.add(show)
+                # a double booking of the venue or artist is rejected right here by the database
+                db.session.flush()
+                record_show(show)
                 db.session.commit()
+                cache.invalidate(('venue', show.venue_id), ('artist', show.artist_id), ('venues',), ('shows',))
                 # on successful db insert, flash success
                 flash('Show was successfully listed!')
+            except IntegrityError as e:
+                db.session.rollback()
+                conflict = booking_conflict(e)
+                if conflict is None:
+                    error = True
+                    app.logger.exception('Show could not be listed')
+                    flash('An error occurred. Show could not be listed.')
+                else:
+                    flash(f'The {conflict} is already booked at that time. Show could not be listed.')
             except:
                 db.session.rollback()
                 error = True
-                print(sys.exc_info)
+                app.logger.exception('Show could not be listed')
                 flash('An error occurred. Show could not be listed.')
             finally:
                 db.session.close()
@@ -480,6 +480,77 @@ def create_app():
         # e.g., flash('An error occurred. Show could not be listed.')
         # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
             return render_template('pages/home.html')
+        # an invalid start time or duration: back to the form, with its errors
+        return render_template('forms/new_show.html', form=form), 400
+
+    @app.route('/shows/tour')
+    def create_tour():
+        form = TourForm()
+        return render_template('forms/new_tour.html', form=form)
+
+    @app.route('/shows/tour', methods=['POST'])
+    def create_tour_submission():
+        # a whole tour in one transaction: every date is reported on, the valid ones are booked
+        form = TourForm(request.form)
+        form.validate()
+        if set(form.errors) - {'dates'}:
+            return render_template('forms/new_tour.html', form=form), 400
+        try:
+            artist_id = int(form.artist_id.data)
+        except ValueError:
+            artist_id = None
+        if artist_id is None or Artist.query.filter(Artist.id == artist_id).count() == 0:
+            form.artist_id.errors.append('No such artist.')
+            return render_template('forms/new_tour.html', form=form), 400
+
+        results, dates = [], []
+        for number, entry in enumerate(form.dates, 1):
+            row = entry.form
+            venue_id = (row.venue_id.data or '').strip()
+            if not venue_id and not ''.join(row.start_time.raw_data or []).strip():
+                continue
+            result = {'row': number, 'venue_id': venue_id, 'start_time': row.start_time.data, 'booked': False,
+                      'errors': [message for messages in row.errors.values() for message in messages]}
+            if not venue_id.isdigit():
+                result['errors'].append('Venue ID must be a number.')
+            if row.start_time.data is None and 'start_time' not in row.errors:
+                result['errors'].append('Start time is required.')
+            if not result['errors']:
+                duration = timedelta(minutes=row.duration.data) if row.duration.data else DEFAULT_SHOW_DURATION
+                result.update(venue_id=int(venue_id), end_time=row.start_time.data + duration)
+                dates.append(result)
+            results.append(result)
+
+        error = False
+        try:
+            booked = book_tour(artist_id, dates)
+            for result, outcome in zip(dates, booked):
+                result.update(booked=outcome['booked'], errors=outcome['errors'])
+            db.session.commit()
+            venues = {result['venue_id'] for result in dates if result['booked']}
+            cache.invalidate(*[('venue', id) for id in venues], ('artist', artist_id), ('venues',), ('shows',))
+            flash(f'{sum(result["booked"] for result in results)} of {len(results)} shows were listed.')
+        except IntegrityError as e:
+            db.session.rollback()
+            conflict = booking_conflict(e)
+            if conflict is None:
+                error = True
+                print(sys.exc_info())
+            else:
+                # booked by someone else since the check; nothing of the tour went in
+                for result in dates:
+                    if result['booked']:
+                        result.update(booked=False, errors=[f'The {conflict} was booked meanwhile; please resubmit.'])
+                flash(f'The {conflict} was booked meanwhile. No show of the tour could be listed.')
+        except:
+            db.session.rollback()
+            error = True
+            print(sys.exc_info())
+        finally:
+            db.session.close()
+        if error:
+            abort(500)
+        return render_template('forms/new_tour.html', form=form, results=results)
 
     @app.errorhandler(404)
     def not_found_error(error):
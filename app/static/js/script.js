@@ -4,7 +4,8 @@ window.parseISOString = function parseISOString(s) {
 };
 
 btn = document.getElementById('del-btn')
-btn.addEventListener('click', function(e) {
+// only venue pages have a delete button
+if (btn) btn.addEventListener('click', function(e) {
   id = parseInt(e.target.getAttribute('data-id'))
   fetch(`/venues/${id}`, {
     method: "DELETE",
@@ -0,0 +1,325 @@
+import asyncio
+import io
+import sys
+
+from flask import Response, abort, render_template, request, session
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+import clock
+from config import SQLALCHEMY_DATABASE_URI
+from app import create_app
+from cache import cache, entity_validators, is_fresh, validator_query
+from models import Venue, Artist, Show, Genre, venue_genre, artist_genre, SHOW_UPCOMING, SHOW_PAST
+from queries import venue_page, artist_page
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    WsgiToAsgi = None
+
+
+# ASGI deployment mode. The detail and search pages are answered on the
+# event loop with SQLAlchemy's asyncio extension (asyncpg or aiosqlite), so
+# a worker keeps serving other requests while their queries are out, and a
+# detail page sends its entity, genre, past and upcoming show queries at
+# once, each on its own pooled connection. Every other route is the Flask
+# app itself, run in a thread pool through asgiref:
+#
+#   uvicorn --factory asgi:create_asgi_app --workers 4
+#   gunicorn -k uvicorn.workers.UvicornWorker -w 4 'asgi:create_asgi_app()'
+#
+# The async views render the same templates inside a regular request
+# context, so before/after_request hooks (Server-Timing, metrics, session)
+# apply as usual, as do the response cache and ETags. They never touch
+# db.session, whose scope is the thread and so would be shared by every
+# request on the loop, and always read from the primary.
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(db_uri):
+    """`db_uri` with the async driver for its database swapped in."""
+    url = make_url(db_uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'no async driver for {backend}; set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_db(config, db_uri):
+    url = make_url(config['ASYNC_DATABASE_URL'] or async_database_url(db_uri))
+    options = {
+        # aiosqlite would otherwise open a new connection (and thread) per query
+        'poolclass': AsyncAdaptedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if url.get_backend_name() != 'sqlite':
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        if config['DB_STATEMENT_TIMEOUT']:
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT'])}}
+    return create_async_engine(url, **options)
+
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+async def _all(engine, statement, **params):
+    async with engine.connect() as conn:
+        return (await conn.execute(statement, params)).all()
+
+
+async def _first(engine, statement, **params):
+    async with engine.connect() as conn:
+        return (await conn.execute(statement, params)).first()
+
+
+def _genres(link_table, key, entity_id):
+    return select(Genre.name).join(link_table, link_table.c.genre_id == Genre.id).where(
+        getattr(link_table.c, key) == entity_id
+    ).order_by(Genre.name)
+
+
+async def venue_detail(engine, venue_id, now):
+    """queries.venue_detail() with the venue, genre and both show queries in flight together."""
+    def shows(predicate):
+        return select(
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link'),
+            Show.start_time,
+        ).join(Artist, Artist.id == Show.artist_id).where(
+            Show.venue_id == venue_id, predicate
+        ).order_by(Show.start_time)
+
+    venue, genres, past_shows, upcoming_shows = await asyncio.gather(
+        _first(engine, select(Venue.__table__).where(Venue.id == venue_id)),
+        _all(engine, _genres(venue_genre, 'venue_id', venue_id)),
+        _all(engine, shows(SHOW_PAST), now=now),
+        _all(engine, shows(SHOW_UPCOMING), now=now),
+    )
+    if venue is None:
+        return None
+    return venue_page(
+        venue, [name for name, in genres],
+        [dict(row._mapping) for row in past_shows], [dict(row._mapping) for row in upcoming_shows],
+    )
+
+
+async def artist_detail(engine, artist_id, now):
+    """queries.artist_detail() with the artist, genre and both show queries in flight together."""
+    def shows(predicate):
+        return select(
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Venue.image_link.label('venue_image_link'),
+            Show.start_time,
+        ).join(Venue, Venue.id == Show.venue_id).where(
+            Show.artist_id == artist_id, predicate
+        ).order_by(Show.start_time)
+
+    artist, genres, past_shows, upcoming_shows = await asyncio.gather(
+        _first(engine, select(Artist.__table__).where(Artist.id == artist_id)),
+        _all(engine, _genres(artist_genre, 'artist_id', artist_id)),
+        _all(engine, shows(SHOW_PAST), now=now),
+        _all(engine, shows(SHOW_UPCOMING), now=now),
+    )
+    if artist is None:
+        return None
+    return artist_page(
+        artist, [name for name, in genres],
+        [dict(row._mapping) for row in past_shows], [dict(row._mapping) for row in upcoming_shows],
+    )
+
+
+async def search(engine, app, model, term):
+    """search.search() run on the async engine; the backend only builds the statement."""
+    limit = app.config['SEARCH_RESULTS_LIMIT']
+    statement = app.extensions['search'].query(model, term).limit(limit).statement
+    rows = await _all(engine, statement)
+    return rows, rows[0].total if rows else 0
+
+
+#----------------------------------------------------------------------------#
+# Views.
+#----------------------------------------------------------------------------#
+
+def _cached_detail(model, namespace, template, name, load):
+    """An async detail view with the conditional() and cache.cached() behaviour of its sync twin."""
+    async def view(app, engine, entity_id):
+        shareable = request.method == 'GET' and not session.get('_flashes')
+        validators = body = None
+        if shareable:
+            row = await _first(engine, validator_query(model, entity_id), now=clock.now())
+            if row is None:
+                abort(404)
+            validators = entity_validators(model, entity_id, *row)
+            if is_fresh(*validators):
+                response = Response(status=304)
+                response.set_etag(validators[0])
+                response.last_modified = validators[1]
+                return response
+
+            key = cache.page_key(namespace, entity_id, validators[0])
+            body = cache.lookup(key)
+
+        if body is None:
+            data = await load(engine, entity_id, clock.now())
+            if data is None:
+                abort(404)
+            body = render_template(template, **{name: data})
+            if shareable:
+                cache.backend.set(key, body.encode())
+
+        response = Response(body, mimetype='text/html')
+        if validators is not None:
+            response.set_etag(validators[0])
+            response.last_modified = validators[1]
+        return response
+    return view
+
+
+def _search_view(model, template):
+    async def view(app, engine):
+        search_term = request.form['search_term']
+        rows, count = await search(engine, app, model, search_term)
+        results = {
+            "count": count,
+            "data": [{
+                "id": row.id,
+                "name": row.name,
+                "num_upcoming_shows": row.upcoming_shows_count,
+            } for row in rows],
+        }
+        return render_template(template, results=results, search_term=search_term)
+    return view
+
+
+# the Flask routes answered here; anything else goes to the Flask app
+ASYNC_ROUTES = Map([
+    Rule('/venues/<int:entity_id>', methods=['GET'], endpoint=_cached_detail(
+        Venue, 'venue', 'pages/show_venue.html', 'venue', venue_detail)),
+    Rule('/artists/<int:entity_id>', methods=['GET'], endpoint=_cached_detail(
+        Artist, 'artist', 'pages/show_artist.html', 'artist', artist_detail)),
+    Rule('/venues/search', methods=['POST'], endpoint=_search_view(Venue, 'pages/search_venues.html')),
+    Rule('/artists/search', methods=['POST'], endpoint=_search_view(Artist, 'pages/search_artists.html')),
+])
+
+
+#----------------------------------------------------------------------------#
+# ASGI app.
+#----------------------------------------------------------------------------#
+
+def _environ(scope, body):
+    """A WSGI environ for an ASGI HTTP scope, for Flask's request context."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsyncApp:
+    """The ASGI application: async read views in front of the Flask app."""
+
+    def __init__(self, app, engine):
+        self.app = app
+        self.engine = engine
+        self.wsgi = WsgiToAsgi(app)
+        self.routes = ASYNC_ROUTES.bind('')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            try:
+                rule, kwargs = self.routes.match(scope['path'], method=scope['method'], return_rule=True)
+            except HTTPException:
+                pass
+            else:
+                return await self.dispatch(rule, kwargs, scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, rule, kwargs, scope, receive, send):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        app = self.app
+        with app.request_context(_environ(scope, body)):
+            # the context matched the Flask twin of the route, so metrics and logs
+            # label it as the sync app does; a route without one keeps the async rule
+            if request.url_rule is None:
+                request.url_rule, request.view_args, request.routing_exception = rule, kwargs, None
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await rule.endpoint(app, self.engine, **kwargs)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+def create_asgi_app(db_uri=SQLALCHEMY_DATABASE_URI, **kwargs):
+    """create_app() served over ASGI, with the read views running on an async engine."""
+    if WsgiToAsgi is None:
+        raise RuntimeError('the ASGI mode needs asgiref (pip install asgiref aiosqlite asyncpg)')
+    app = create_app(db_uri, **kwargs)
+    return AsyncApp(app, create_async_db(app.config, db_uri))
@@ -0,0 +1,243 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import Response, abort, current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+
+# Static asset pipeline. `flask fyyur build-assets` writes every file under
+# app/static to app/static/dist under a content-hashed name, concatenates
+# and minifies the bundles below, pre-compresses text assets as .gz and .br
+# and records original -> hashed names in dist/manifest.json. Templates ask
+# static_url() for a file by its original name; hashed files are served
+# with the best encoding the client accepts and cached for a year, since a
+# changed file gets a new name.
+#
+# Without a build, static_url() falls back to the plain static URLs and
+# bundles are concatenated on request, so development needs no build step.
+
+# bundle -> sources, in load order
+BUNDLES = {
+    'css/fyyur.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    # loaded in <head>, before the page renders
+    'js/head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    # deferred; script.js last, so nothing else depends on it having run
+    'js/fyyur.js': [
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+        'js/script.js',
+    ],
+}
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# worth pre-compressing; images and woff fonts are compressed already
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.eot', '.ttf', '.otf', '.ico'}
+# (Accept-Encoding token, file suffix), best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_CSS_STRINGS = re.compile(r'''("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')''')
+_CSS_COMMENTS = re.compile(r'/\*(?!!).*?\*/', re.S)
+_SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+
+
+#----------------------------------------------------------------------------#
+# Minifiers.
+#----------------------------------------------------------------------------#
+
+def minify_css(css):
+    """Drop comments (but /*! licences) and redundant whitespace, leaving strings alone."""
+    parts = _CSS_STRINGS.split(_CSS_COMMENTS.sub('', css))
+    for i in range(0, len(parts), 2):
+        code = re.sub(r'\s+', ' ', parts[i])
+        code = re.sub(r' ?([{};,>]) ?', r'\1', code)
+        parts[i] = code.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(source, name):
+    # already minified files are left as they are; rjsmin, when installed, takes the rest
+    if rjsmin is None or name.endswith('.min.js'):
+        return source
+    return rjsmin.jsmin(source)
+
+
+#----------------------------------------------------------------------------#
+# Build.
+#----------------------------------------------------------------------------#
+
+def _read(static_folder, name):
+    with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def _hashed_name(name, content):
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _rewrite_css_urls(css, source, manifest, static_url_path):
+    """Point url()s of a bundled stylesheet at their hashed copies, or at absolute static URLs.
+
+    The bundle lives in another directory than its sources, so relative
+    URLs cannot be kept as they are.
+    """
+    def replace(match):
+        url = match.group(2).strip()
+        if re.match(r'^(?:[a-z]+:|/|#)', url, re.I):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        if target in manifest:
+            return f'url("{static_url_path}/{DIST}/{manifest[target]}{suffix}")'
+        return f'url("{static_url_path}/{target}{suffix}")'
+    return _CSS_URL.sub(replace, css)
+
+
+def bundle(static_folder, name, manifest=None, static_url_path='/static', minify=True):
+    """The concatenated (and minified) contents of a bundle."""
+    manifest = manifest or {}
+    parts = []
+    for source in BUNDLES[name]:
+        content = _read(static_folder, source)
+        if name.endswith('.css'):
+            content = _rewrite_css_urls(content, source, manifest, static_url_path)
+            parts.append(minify_css(content) if minify else content)
+        else:
+            # the maps belong to the single files, not to the bundle
+            content = _SOURCE_MAP.sub('', content)
+            # on its own line, in case a source ends in a // comment
+            parts.append((minify_js(content, source) if minify else content).rstrip() + '\n;')
+    return '\n'.join(parts) + '\n'
+
+
+def _write(dist, name, content):
+    path = os.path.join(dist, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    written = [(name, len(content))]
+    if posixpath.splitext(name)[1] in COMPRESSIBLE:
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content, quality=11)))
+        for suffix, compressed in variants:
+            # a variant that saves nothing would only cost a negotiation
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written.append((name + suffix, len(compressed)))
+    return written
+
+
+def build_assets(static_folder, static_url_path='/static'):
+    """Rebuild static/dist and its manifest; returns [(written name, bytes)]."""
+    dist = os.path.join(static_folder, DIST)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+
+    manifest, written = {}, []
+    for directory, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = sorted(d for d in dirnames if os.path.join(directory, d) != dist)
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                content = f.read()
+            manifest[name] = _hashed_name(name, content)
+            written.extend(_write(dist, manifest[name], content))
+
+    # bundles last, so their url()s can point at the hashed files
+    for name in BUNDLES:
+        content = bundle(static_folder, name, manifest, static_url_path).encode('utf-8')
+        manifest[name] = _hashed_name(name, content)
+        written.extend(_write(dist, manifest[name], content))
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return written
+
+
+#----------------------------------------------------------------------------#
+# Serving.
+#----------------------------------------------------------------------------#
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def static_url(filename):
+    """The URL of a static file by its source name: hashed when built, plain otherwise."""
+    manifest = current_app.extensions['assets']
+    if filename in manifest:
+        return url_for('static_asset', filename=manifest[filename])
+    if filename in BUNDLES:
+        return url_for('static_asset', filename=filename)
+    return url_for('static', filename=filename)
+
+
+def _preferred_encoding(dist, filename):
+    for token, suffix in ENCODINGS:
+        if request.accept_encodings[token] and os.path.isfile(os.path.join(dist, filename + suffix)):
+            return token, suffix
+    return None, ''
+
+
+def setup_assets(app):
+    manifest = app.extensions['assets'] = load_manifest(app.static_folder)
+    app.jinja_env.globals['static_url'] = static_url
+    dist = os.path.join(app.static_folder, DIST)
+    hashed = set(manifest.values())
+
+    @app.route(f'{app.static_url_path}/{DIST}/<path:filename>', endpoint='static_asset')
+    def static_asset(filename):
+        if filename not in hashed:
+            if filename in BUNDLES and not manifest:
+                # no build yet: the bundle as it would be, unminified and uncached
+                content = bundle(app.static_folder, filename, static_url_path=app.static_url_path, minify=False)
+                response = Response(content, mimetype=mimetypes.guess_type(filename)[0])
+                response.cache_control.no_cache = True
+                return response
+            abort(404)
+
+        encoding, suffix = _preferred_encoding(dist, filename)
+        response = send_from_directory(
+            dist, filename + suffix, mimetype=mimetypes.guess_type(filename)[0], max_age=31536000,
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
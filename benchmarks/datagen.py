@@ -0,0 +1,173 @@
+"""Deterministic synthetic catalog: venues, artists and shows with realistic skew.
+
+A handful of big cities hold most venues and artists, a few genres dominate,
+and show counts follow a long tail, so a few venues and artists have
+hundreds of shows while most have a handful. The same seed always produces
+the same rows, with show times relative to the hour the data is generated.
+
+    python benchmarks/datagen.py --db sqlite:////tmp/fyyur_bench.db --venues 2000 --artists 5000 --shows 100000
+
+The database is dropped and rebuilt with db.create_all(), so never point
+--db at a database you care about.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from counters import roll_show_counters
+from models import db, Venue, Artist, Show, Genre, venue_genre, artist_genre
+
+
+# (city, state, weight): roughly metro-size weights
+CITIES = [
+    ('New York', 'NY', 30), ('Los Angeles', 'CA', 20), ('Chicago', 'IL', 12),
+    ('San Francisco', 'CA', 10), ('Austin', 'TX', 8), ('Nashville', 'TN', 7),
+    ('Seattle', 'WA', 6), ('New Orleans', 'LA', 5), ('Denver', 'CO', 4),
+    ('Portland', 'OR', 3), ('Atlanta', 'GA', 3), ('Detroit', 'MI', 2),
+    ('Minneapolis', 'MN', 2), ('Memphis', 'TN', 1), ('Boise', 'ID', 1),
+]
+
+# (genre, weight); every name is one of the forms' genre choices
+GENRES = [
+    ('Rock n Roll', 20), ('Pop', 16), ('Hip-Hop', 14), ('Electronic', 10), ('Jazz', 8),
+    ('Alternative', 8), ('R&B', 6), ('Country', 6), ('Blues', 4), ('Folk', 4),
+    ('Soul', 3), ('Funk', 3), ('Classical', 2), ('Reggae', 2), ('Punk', 2),
+    ('Heavy Metal', 2), ('Instrumental', 1), ('Musical Theatre', 1), ('Other', 2),
+]
+
+# evening start hours and show length; slots never overlap
+SLOTS = (18, 20, 22)
+SHOW_LENGTH = timedelta(hours=2)
+
+WORDS = [
+    'Musical', 'Hop', 'Park', 'Square', 'Live', 'Music', 'Coffee', 'Dueling', 'Pianos', 'Bar',
+    'Hall', 'Lounge', 'Garage', 'Basement', 'Theatre', 'Club', 'Tavern', 'Room', 'House', 'Cellar',
+    'Velvet', 'Echo', 'Neon', 'Blue', 'Golden', 'Wild', 'Silver', 'Midnight', 'Electric', 'Royal',
+]
+
+
+def _cumulative(weights):
+    total, cumulative = 0, []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _long_tail(count, exponent=1.1):
+    # Zipf-like cumulative weights over ids 1..count
+    return _cumulative(1 / rank ** exponent for rank in range(1, count + 1))
+
+
+def _insert(table, rows, batch_size=10000):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start:start + batch_size])
+
+
+def generate(venues, artists, shows, seed=42, now=None):
+    """Insert the catalog into the current app's database and roll the show counters.
+
+    Returns the number of shows inserted, which can fall short of `shows`
+    when the busiest venues and artists run out of free slots.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    cities = [(city, state) for city, state, _ in CITIES]
+    city_weights = _cumulative(weight for _, _, weight in CITIES)
+    genre_names = [name for name, _ in GENRES]
+    genre_weights = _cumulative(weight for _, weight in GENRES)
+
+    _insert(Genre.__table__, [{'id': id, 'name': name} for id, name in enumerate(genre_names, 1)])
+
+    def entities(model, link, count, extra):
+        rows, links = [], []
+        key = f'{model.__tablename__}_id'
+        for id in range(1, count + 1):
+            city, state = rng.choices(cities, cum_weights=city_weights)[0]
+            rows.append(dict({
+                'id': id,
+                'name': ' '.join(rng.sample(WORDS, rng.choice((2, 2, 3)))) + f' {id}',
+                'city': city,
+                'state': state,
+                'phone': f'{rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(1000, 9999)}',
+                'facebook_link': f'https://www.facebook.com/{model.__tablename__}{id}',
+                'seeking_description': None,
+            }, **extra(id)))
+            genres = {rng.choices(genre_names, cum_weights=genre_weights)[0] for _ in range(rng.randint(1, 3))}
+            links.extend({'genre_id': genre_names.index(name) + 1, key: id} for name in genres)
+        _insert(model.__table__, rows)
+        _insert(link, links)
+
+    entities(Venue, venue_genre, venues, lambda id: {
+        'address': f'{rng.randint(1, 9999)} {rng.choice(WORDS)} St',
+        'seeking_talent': rng.random() < 0.3,
+    })
+    entities(Artist, artist_genre, artists, lambda id: {
+        'seeking_venue': rng.random() < 0.4,
+    })
+
+    # two years of past shows and one of upcoming ones, in three two-hour
+    # evening slots; a pair whose venue or artist is already booked in the
+    # drawn slot is moved to another one, and dropped after a few tries
+    venue_weights = _long_tail(venues)
+    artist_weights = _long_tail(artists)
+    venue_ids = range(1, venues + 1)
+    artist_ids = range(1, artists + 1)
+    booked = set()
+    show_rows = []
+    for venue_id, artist_id in zip(
+        rng.choices(venue_ids, cum_weights=venue_weights, k=shows),
+        rng.choices(artist_ids, cum_weights=artist_weights, k=shows),
+    ):
+        for _ in range(10):
+            slot = (rng.randint(-730, 365), rng.choice(SLOTS))
+            if ('venue', venue_id) + slot not in booked and ('artist', artist_id) + slot not in booked:
+                break
+        else:
+            continue
+        booked.update((('venue', venue_id) + slot, ('artist', artist_id) + slot))
+        day, hour = slot
+        start_time = now + timedelta(days=day, hours=hour - now.hour)
+        show_rows.append({
+            'venue_id': venue_id,
+            'artist_id': artist_id,
+            'start_time': start_time,
+            'end_time': start_time + SHOW_LENGTH,
+        })
+    _insert(Show.__table__, show_rows)
+    db.session.commit()
+
+    roll_show_counters(now=now)
+    return len(show_rows)
+
+
+def main():
+    from app import create_app
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='database URI')
+    parser.add_argument('--venues', type=int, default=2000)
+    parser.add_argument('--artists', type=int, default=5000)
+    parser.add_argument('--shows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    app = create_app(args.db)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        shows = generate(args.venues, args.artists, args.shows, seed=args.seed)
+        print(f'generated {args.venues} venues, {args.artists} artists and {shows} shows '
+              f'in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
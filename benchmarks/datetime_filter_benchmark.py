@@ -0,0 +1,68 @@
+"""Per-call cost of the `datetime` Jinja filter, before and after caching.
+
+    python benchmarks/datetime_filter_benchmark.py --calls 20000
+
+"before" is the original filter: str() the datetime in the view, then
+dateutil-parse it and let Babel re-parse the pattern on every call.
+"after" is the registered filter fed datetimes, with cold and warm caches.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import babel.dates
+import dateutil.parser
+
+import app as fyyur
+
+
+def original_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format="EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format="EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--distinct', type=int, default=500,
+                        help='distinct start times, e.g. the tiles of one /shows page')
+    args = parser.parse_args()
+
+    application = fyyur.create_app('sqlite:///' + os.path.join(tempfile.mkdtemp(), 'unused.db'))
+    format_datetime = application.jinja_env.filters['datetime']
+
+    base = datetime(2026, 10, 18, 20, 30)
+    values = [base + timedelta(hours=i) for i in range(args.distinct)]
+    strings = [str(value) for value in values]
+    for value, string in zip(values, strings):
+        assert format_datetime(value, 'full') == original_format_datetime(string, 'full')
+
+    def before():
+        for i in range(args.calls):
+            original_format_datetime(strings[i % args.distinct], 'full')
+
+    def after_cold():
+        fyyur._format_datetime.cache_clear()
+        for i in range(args.calls):
+            format_datetime(values[i % args.distinct] + timedelta(microseconds=i), 'full')
+
+    def after_warm():
+        for i in range(args.calls):
+            format_datetime(values[i % args.distinct], 'full')
+
+    for name, run in (('before', before), ('after, all distinct', after_cold), ('after, repeated', after_warm)):
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        print(f'{name:>20}: {seconds / args.calls * 1e6:7.2f} us/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+
+from flask import Response, g, jsonify, make_response, request, session
+from sqlalchemy import func, select
+
+import clock
+from metrics import record_cache_lookup
+from models import db, Show, SHOW_PAST
+
+
+#----------------------------------------------------------------------------#
+# Backends.
+#----------------------------------------------------------------------------#
+
+class SimpleCache:
+    """In-process LRU cache with a per-entry TTL.
+
+    Entries are per worker process, so with several gunicorn workers an edit
+    only invalidates the worker that served it; use RedisCache there.
+    """
+
+    # invalidate() from another process (e.g. the CLI) does not reach it
+    shared = False
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # generations live outside the LRU so they are never evicted
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self, key):
+        return self._generations.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class RedisCache:
+    """Cache shared by every worker, on Redis or anything speaking its protocol."""
+
+    shared = True
+
+    def __init__(self, url, ttl=60, prefix='fyyur:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def generation(self, key):
+        return int(self.client.get(self.prefix + 'gen:' + key) or 0)
+
+    def bump(self, key):
+        self.client.incr(self.prefix + 'gen:' + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class NullCache:
+    """Caching switched off."""
+
+    # nothing is cached, so nothing can go stale
+    shared = True
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def generation(self, key):
+        return 0
+
+    def bump(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+#----------------------------------------------------------------------------#
+# Response cache.
+#----------------------------------------------------------------------------#
+
+class ResponseCache:
+    """Caches rendered GET pages per route and entity id.
+
+    Every page belongs to a scope, either a listing such as ('venues',) or an
+    entity such as ('venue', 3). Cache keys embed the scope's generation, so
+    invalidate() drops every variant of a scope (query strings included) by
+    bumping one counter, and the stale entries simply age out. They also
+    embed the request clock's bucketed "now", so a page split into past and
+    upcoming shows is never served past the bucket it was rendered in.
+    """
+
+    def __init__(self):
+        self.backend = NullCache()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        name = app.config['CACHE_BACKEND']
+        ttl = app.config['CACHE_DEFAULT_TTL']
+        if name == 'simple':
+            self.backend = SimpleCache(app.config['CACHE_MAX_ENTRIES'], ttl)
+        elif name == 'redis':
+            self.backend = RedisCache(app.config['CACHE_REDIS_URL'], ttl)
+        else:
+            self.backend = NullCache()
+        app.extensions['cache'] = self
+
+    def _count(self, hit):
+        record_cache_lookup(hit)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+    @staticmethod
+    def _scope(namespace, entity_id=None):
+        return namespace if entity_id is None else f'{namespace}:{entity_id}'
+
+    def invalidate(self, *scopes):
+        """Drop every cached page of each ('namespace',) or ('namespace', id) scope."""
+        for scope in scopes:
+            self.backend.bump(self._scope(*scope))
+
+    def page_key(self, namespace, entity_id=None, version=''):
+        """The key of the current request's page in the ('namespace', entity_id) scope.
+
+        `version` is the page's ETag when it has one, so a worker whose
+        cache missed an invalidation cannot serve an old body under it.
+        """
+        scope = self._scope(namespace, entity_id)
+        epoch = clock.now().isoformat() if clock.current_clock().bucket else ''
+        return 'page:{}:{}:{}:{}:{}'.format(
+            scope, self.backend.generation(scope), epoch, version, request.query_string.decode()
+        )
+
+    def lookup(self, key):
+        """The cached body under `key`, or None; counted as a hit or a miss."""
+        body = self.backend.get(key)
+        self._count(body is not None)
+        return body
+
+    def cached(self, namespace, id_arg=None):
+        """Cache a view's 200 responses under ('namespace', kwargs[id_arg])."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # pages rendered with pending flash messages must not be shared
+                if request.method != 'GET' or session.get('_flashes'):
+                    return view(*args, **kwargs)
+
+                key = self.page_key(namespace, kwargs.get(id_arg) if id_arg else None, g.get('etag', ''))
+                body = self.lookup(key)
+                if body is not None:
+                    return Response(body, mimetype='text/html')
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    self.backend.set(key, response.get_data())
+                return response
+            return wrapper
+        return decorator
+
+
+cache = ResponseCache()
+
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+def validator_query(model, entity_id):
+    """The entity's updated_at and the start of its latest show to have begun.
+
+    An entity page changes with its row and whenever one of its shows moves
+    from upcoming to past; the latter is one index seek on (venue_id or
+    artist_id, start_time). Execute with the request clock's `now`.
+    """
+    last_started = select(func.max(Show.start_time)).where(
+        getattr(Show, f'{model.__tablename__}_id') == entity_id, SHOW_PAST,
+    ).scalar_subquery()
+    return select(model.updated_at, last_started).where(model.id == entity_id)
+
+
+def entity_validators(model, entity_id, updated_at, last_started=None):
+    """The strong ETag and the Last-Modified of an entity page."""
+    # both are APP_TIMEZONE wall times, not the server's local time
+    zone_clock = clock.current_clock()
+    changed = updated_at = zone_clock.from_db(updated_at)
+    etag = f'{model.__tablename__}-{entity_id}-{int(updated_at.timestamp() * 1000000)}'
+    if last_started is not None:
+        last_started = zone_clock.from_db(last_started)
+        etag += f'-{int(last_started.timestamp())}'
+        changed = max(updated_at, last_started)
+    return etag, changed.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def is_fresh(etag, last_modified):
+    """Whether the current request already holds this version of the page."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    return bool(request.if_modified_since and request.if_modified_since >= last_modified)
+
+
+def conditional(model, id_arg):
+    """Answer revalidations of an entity page with 304 before any rendering.
+
+    The strong ETag and Last-Modified come from the row's updated_at, which
+    every write that changes the page bumps, and from the start of the
+    latest show to have begun by the request clock's "now", which moves a
+    show from upcoming to past without a write. The check is one indexed
+    statement and the view (with its shows query) only runs on a miss.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            entity_id = kwargs[id_arg]
+            row = db.session.execute(validator_query(model, entity_id), {'now': clock.now()}).first()
+            if row is None:
+                return view(*args, **kwargs)
+
+            etag, last_modified = entity_validators(model, entity_id, *row)
+            # for cache.cached() below, which keys the page body by it
+            g.etag = etag
+            response = Response(status=304) if is_fresh(etag, last_modified) else make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
+def setup_cache(app):
+    cache.init_app(app)
+
+    @app.route('/cache/stats')
+    def cache_stats():
+        return jsonify(cache.stats())
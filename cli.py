@@ -0,0 +1,188 @@
+from datetime import timedelta
+
+import json
+import os
+import sys
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import clock
+from assets import brotli, build_assets
+from cache import cache
+from counters import roll_show_counters
+from importer import KINDS, Importer, read_rows
+from exporter import EXPORTS, FORMATS, iter_records, iter_csv, iter_ndjson, write_parquet
+from images import derivative, static_images
+
+
+fyyur_cli = AppGroup('fyyur', help='Fyyur maintenance commands.')
+
+
+def invalidate_pages(*scopes):
+    # the web workers only see this with a shared backend; CACHE_BACKEND=simple
+    # keeps a cache per process, which here would be the CLI's own
+    if cache.backend.shared:
+        cache.invalidate(*scopes)
+    else:
+        click.echo(
+            f'CACHE_BACKEND is simple: cached pages refresh within CACHE_DEFAULT_TTL '
+            f'({current_app.config["CACHE_DEFAULT_TTL"]}s). Use redis to refresh them at once.', err=True,
+        )
+
+
+@fyyur_cli.command('roll-shows')
+@click.option('--window', default=60, show_default=True,
+              help='Minutes to look back; run at least this often, e.g. from cron.')
+@click.option('--all', 'rebuild', is_flag=True, help='Rebuild every show counter from scratch.')
+def roll_shows(window, rebuild):
+    """Move shows that have started from the upcoming to the past counters.
+
+    Cached /venues pages are refreshed at once with CACHE_BACKEND=redis;
+    with the in-process cache they refresh within CACHE_DEFAULT_TTL.
+    """
+    now = clock.now()
+    since = None if rebuild else now - timedelta(minutes=window)
+    updated = roll_show_counters(since=since, now=now)
+    # /venues shows the upcoming counters
+    invalidate_pages(('venues',))
+    click.echo(f'Recounted shows for {updated} venues and artists.')
+
+
+@fyyur_cli.command('invalidate-cache')
+@click.argument('scopes', nargs=-1, metavar='[SCOPE]...')
+def invalidate_cache(scopes):
+    """Drop cached pages, e.g. after editing the database by hand.
+
+    A SCOPE is a listing (venues, artists, shows) or a single page
+    (venue:3, artist:7); all three listings by default. Only works with
+    CACHE_BACKEND=redis, as the web workers cannot see a simple cache
+    held by this process.
+    """
+    if not cache.backend.shared:
+        raise click.ClickException(
+            'CACHE_BACKEND is simple: cached pages live in each web worker and refresh within '
+            f'CACHE_DEFAULT_TTL ({current_app.config["CACHE_DEFAULT_TTL"]}s).'
+        )
+    scopes = [tuple(scope.split(':', 1)) for scope in scopes or ('venues', 'artists', 'shows')]
+    cache.invalidate(*scopes)
+    click.echo(f'Invalidated {", ".join(":".join(scope) for scope in scopes)}.')
+
+
+@fyyur_cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']),
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--copy/--no-copy', 'use_copy', default=None,
+              help='Use Postgres COPY instead of executemany; on by default on Postgres.')
+@click.option('--rejects', type=click.Path(dir_okay=False, writable=True),
+              help='Write rejected rows and their errors to this NDJSON file.')
+def import_rows(kind, path, format, batch_size, use_copy, rejects):
+    """Bulk load venues, artists or shows from a CSV or NDJSON file.
+
+    Rows are streamed, validated with the same rules as the web forms and
+    inserted in batches, so memory use does not grow with the file. Cached
+    listing pages are refreshed at once with CACHE_BACKEND=redis; with the
+    in-process cache they refresh within CACHE_DEFAULT_TTL.
+    """
+    if format is None:
+        format = 'csv' if os.path.splitext(path)[1].lower() == '.csv' else 'ndjson'
+
+    rejects_file = open(rejects, 'w') if rejects else None
+
+    def on_reject(line_num, row, errors):
+        if rejects_file is not None:
+            rejects_file.write(json.dumps({'line': line_num, 'errors': errors, 'row': row}, default=str) + '\n')
+        elif stats.rejected <= 20:
+            click.echo(f'line {line_num}: {errors}', err=True)
+
+    importer = Importer(kind, batch_size=batch_size, use_copy=use_copy, on_reject=on_reject)
+    stats = importer.stats
+    try:
+        with open(path, newline='') as stream:
+            importer.run(read_rows(stream, format))
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+
+    invalidate_pages(('venues',), ('artists',), ('shows',))
+    click.echo(
+        f'{stats.inserted} {kind}s imported, {stats.rejected} rejected, '
+        f'{stats.read} read in {stats.elapsed:.1f}s ({stats.rows_per_second:.0f} rows/s)'
+    )
+
+
+@fyyur_cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'format', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+              help='File to write; standard output by default (required for parquet).')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S']),
+              help='Only rows modified at or after this time, for incremental dumps.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched per round trip.')
+def export_rows(kind, format, output, since, batch_size):
+    """Dump venues, artists or shows as CSV, NDJSON or Parquet.
+
+    Rows are read through a server-side cursor and written batch by batch,
+    so memory use does not grow with the table.
+    """
+    records = iter_records(kind, since=since, batch_size=batch_size)
+    if format == 'parquet':
+        if output is None:
+            raise click.UsageError('--output is required for parquet')
+        try:
+            write_parquet(kind, records, output)
+        except RuntimeError as error:
+            raise click.ClickException(str(error))
+        return
+
+    if format == 'csv':
+        chunks = (chunk.encode() for chunk in iter_csv(kind, records, batch_size))
+    else:
+        chunks = iter_ndjson(records, batch_size)
+    stream = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
+
+
+@fyyur_cli.command('build-assets')
+def build_assets_command():
+    """Bundle, minify, fingerprint and pre-compress app/static into app/static/dist."""
+    app = current_app
+    written = build_assets(app.static_folder, app.static_url_path)
+    originals = [(name, size) for name, size in written if not name.endswith(('.gz', '.br'))]
+    compressed = dict(written)
+    for name, size in originals:
+        variants = ', '.join(
+            f'{suffix[1:]} {compressed[name + suffix]:,}' for suffix in ('.gz', '.br') if name + suffix in compressed
+        )
+        click.echo(f'{name:<60} {size:>10,}' + (f'  ({variants})' if variants else ''))
+    click.echo(f'Wrote {len(originals)} assets and dist/manifest.json; restart the app to serve them.')
+    if brotli is None:
+        click.echo('brotli is not installed; only gzip variants were written.', err=True)
+
+
+@fyyur_cli.command('build-images')
+def build_images_command():
+    """Render the responsive derivatives of the images under app/static ahead of first request.
+
+    Run after build-assets, whose fingerprints the derivatives are keyed by.
+    """
+    app = current_app
+    formats = app.extensions['images']['formats']
+    if not formats:
+        raise click.ClickException('Pillow is not installed; pages link to the original images.')
+    for source in static_images(app.static_folder):
+        sizes = []
+        for format in formats:
+            for width in app.config['IMAGE_WIDTHS']:
+                sizes.append(os.path.getsize(derivative('static', source, width, format)))
+        click.echo(f'{source:<40} {os.path.getsize(os.path.join(app.static_folder, source)):>10,} -> '
+                   f'{len(sizes)} derivatives, {min(sizes):,} to {max(sizes):,} bytes')
@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+
+from dateutil import tz
+from flask import current_app, g, has_app_context, has_request_context
+
+import config
+
+
+# One clock for the whole app. Start times and updated_at are stored as naive
+# wall-clock times in APP_TIMEZONE (the server's local zone when unset);
+# the clock is timezone-aware and converts to that convention at the edge.
+#
+# now() is read once per request and rounded down to CLOCK_BUCKET_SECONDS,
+# so every past/upcoming split in a request agrees, and cached pages and
+# query parameters stay identical for the length of a bucket.
+
+
+class Clock:
+    """Tells the time in the app's timezone; `frozen` pins it, for tests and benchmarks."""
+
+    def __init__(self, zone=None, bucket=0, frozen=None):
+        self.zone = tz.gettz(zone) if isinstance(zone, str) or zone is None else zone
+        self.bucket = bucket
+        self.frozen = frozen
+
+    def now(self):
+        """The current time, timezone-aware."""
+        if self.frozen is not None:
+            value = self.frozen
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=self.zone)
+            return value.astimezone(self.zone)
+        return datetime.now(timezone.utc).astimezone(self.zone)
+
+    def bucketed(self, value):
+        if not self.bucket:
+            return value
+        seconds = int(value.timestamp()) // self.bucket * self.bucket
+        return datetime.fromtimestamp(seconds, value.tzinfo)
+
+    def to_db(self, value):
+        """An aware datetime as the naive wall time the DateTime columns hold."""
+        return value.astimezone(self.zone).replace(tzinfo=None)
+
+    def from_db(self, value):
+        """A naive wall time from the DateTime columns as an aware datetime."""
+        return value.replace(tzinfo=self.zone)
+
+
+def setup_clock(app, clock=None):
+    if clock is None:
+        clock = Clock(app.config['APP_TIMEZONE'], app.config['CLOCK_BUCKET_SECONDS'])
+    app.extensions['clock'] = clock
+
+
+def current_clock():
+    if has_app_context() and 'clock' in current_app.extensions:
+        return current_app.extensions['clock']
+    return Clock(config.APP_TIMEZONE, config.CLOCK_BUCKET_SECONDS)
+
+
+def now():
+    """The request's "now", bucketed, as a naive wall time comparable with the columns.
+
+    Outside a request (CLI commands, scripts) it is read afresh on every call.
+    """
+    if has_request_context() and 'now' in g:
+        return g.now
+    clock = current_clock()
+    value = clock.to_db(clock.bucketed(clock.now()))
+    if has_request_context():
+        g.now = value
+    return value
+
+
+def timestamp():
+    """The exact current time, naive like now(); for updated_at and other write stamps."""
+    clock = current_clock()
+    return clock.to_db(clock.now())
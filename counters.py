@@ -0,0 +1,91 @@
+from sqlalchemy import func, select
+
+import clock
+from models import db, Venue, Artist, Show, SHOW_UPCOMING, SHOW_PAST
+
+
+# Venue and Artist carry upcoming_shows_count / past_shows_count so listing
+# and search pages never aggregate the show table. Writes keep them current;
+# time moving a show from upcoming to past is caught up by roll_show_counters(),
+# run periodically through `flask fyyur roll-shows`.
+
+COUNTED = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+
+def _counter(start_time, now):
+    return 'upcoming_shows_count' if start_time >= now else 'past_shows_count'
+
+
+def record_show(show, now=None):
+    """Count a newly added show against its venue and artist.
+
+    Issues atomic `count = count + 1` updates in the caller's transaction.
+    """
+    if now is None:
+        now = clock.now()
+
+    name = _counter(show.start_time, now)
+    for model, key in COUNTED:
+        column = getattr(model, name)
+        model.query.filter(model.id == getattr(show, key.key)).update(
+            {column: column + 1}, synchronize_session=False
+        )
+
+
+def delete_venue_shows(venue_id, now=None):
+    """Delete a venue's shows and recount their artists' counters.
+
+    Recounted rather than decremented: the stored counters only move from
+    upcoming to past when roll-shows runs, so subtracting counts taken at
+    `now` would go wrong for shows that started since the last roll.
+    Runs in the caller's transaction so the venue can be deleted right after.
+    """
+    artist_ids = [id for id, in db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()]
+    Show.query.filter(Show.venue_id == venue_id).delete(synchronize_session=False)
+    recount_show_counters([], artist_ids, now)
+
+
+def _recount(model, key, ids, now):
+    # recompute both counters from the show table for the given ids (or all rows)
+    shows = select(func.count(Show.id)).where(key == model.id)
+    query = model.query.params(now=now)
+    if ids is not None:
+        query = query.filter(model.id.in_(ids))
+    return query.update({
+        model.upcoming_shows_count: shows.where(SHOW_UPCOMING).scalar_subquery(),
+        model.past_shows_count: shows.where(SHOW_PAST).scalar_subquery(),
+    }, synchronize_session=False)
+
+
+def recount_show_counters(venue_ids, artist_ids, now=None):
+    """Recount the counters of the given venues and artists, e.g. after a bulk load.
+
+    Runs in the caller's transaction.
+    """
+    if now is None:
+        now = clock.now()
+
+    for (model, key), ids in zip(COUNTED, (venue_ids, artist_ids)):
+        ids = list(ids)
+        if ids:
+            _recount(model, key, ids, now)
+
+
+def roll_show_counters(since=None, now=None):
+    """Move shows that started in [since, now) from upcoming to past.
+
+    Only venues and artists with a show in that window are recounted, so a
+    run costs O(shows in the window). With since=None every counter is
+    rebuilt from scratch. Returns the number of venue and artist rows updated.
+    """
+    if now is None:
+        now = clock.now()
+
+    updated = 0
+    for model, key in COUNTED:
+        ids = None
+        if since is not None:
+            ids = select(key).where(Show.start_time >= since, SHOW_PAST).distinct()
+        updated += _recount(model, key, ids, now)
+    db.session.commit()
+    return updated
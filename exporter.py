@@ -0,0 +1,115 @@
+import csv
+import io
+
+from sqlalchemy.orm import load_only, selectinload
+
+from models import db, Venue, Artist, Show
+from queries import ENTITY_FIELDS
+from serializers import dumps
+
+
+EXPORTS = {
+    'venue': (Venue, ENTITY_FIELDS[Venue] + ('updated_at',)),
+    'artist': (Artist, ENTITY_FIELDS[Artist] + ('updated_at',)),
+    'show': (Show, ('id', 'venue_id', 'artist_id', 'start_time', 'end_time', 'updated_at')),
+}
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+
+
+#----------------------------------------------------------------------------#
+# Reading.
+#----------------------------------------------------------------------------#
+
+def iter_records(kind, since=None, batch_size=1000):
+    """Yield every row of `kind` as a dict, `batch_size` rows at a time.
+
+    Rows come from a server-side cursor (stream_results + yield_per), so
+    memory stays flat however large the table is. `since` limits the export
+    to rows whose updated_at is at or after it, for incremental dumps.
+    """
+    model, fields = EXPORTS[kind]
+    columns = [getattr(model, field) for field in fields if field not in ('id', 'genres')]
+    query = model.query.options(load_only(model.id, *columns))
+    if 'genres' in fields:
+        query = query.options(selectinload(model.genre_items))
+    if since is not None:
+        query = query.filter(model.updated_at >= since)
+    query = query.order_by(model.id).execution_options(stream_results=True).yield_per(batch_size)
+
+    try:
+        for row in query:
+            yield {field: getattr(row, field) for field in fields}
+            # drop exported objects so the identity map does not grow with the table
+            db.session.expunge(row)
+    finally:
+        db.session.rollback()
+
+
+def _batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+#----------------------------------------------------------------------------#
+# Writing.
+#----------------------------------------------------------------------------#
+
+def iter_csv(kind, records, batch_size=1000):
+    """Yield CSV text in chunks of `batch_size` rows, header first."""
+    _, fields = EXPORTS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for batch in _batches(records, batch_size):
+        for record in batch:
+            if 'genres' in record:
+                record = dict(record, genres=','.join(record['genres']))
+            writer.writerow([record[field] for field in fields])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(records, batch_size=1000):
+    """Yield NDJSON bytes in chunks of `batch_size` lines."""
+    for batch in _batches(records, batch_size):
+        yield b''.join(dumps(record) + b'\n' for record in batch)
+
+
+def write_parquet(kind, records, path, batch_size=10000):
+    """Write records to a Parquet file, one row group per batch.
+
+    Needs pyarrow, which is an optional dependency.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export needs pyarrow: pip install pyarrow')
+
+    model, fields = EXPORTS[kind]
+    types = {
+        db.Integer: pa.int64(),
+        db.Boolean: pa.bool_(),
+        db.DateTime: pa.timestamp('us'),
+        db.String: pa.string(),
+    }
+    schema = pa.schema([
+        (field, pa.list_(pa.string()) if field == 'genres' else next(
+            arrow_type for sql_type, arrow_type in types.items()
+            if isinstance(model.__table__.c[field].type, sql_type)
+        ))
+        for field in fields
+    ])
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in _batches(records, batch_size):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
@@ -1,7 +1,8 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import Form as BaseForm
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField, FieldList, FormField
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange, Optional
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -13,7 +14,40 @@ class ShowForm(Form):
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
-        default= datetime.today()
+        default= datetime.today
+    )
+    # minutes; shows are capped at a day (models.MAX_SHOW_DURATION), left empty they take models.DEFAULT_SHOW_DURATION
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)],
+        default=120
+    )
+
+# one row of a TourForm; a plain wtforms form, the enclosing form carries the CSRF token
+class TourDateForm(BaseForm):
+    venue_id = StringField(
+        'venue_id'
+    )
+    start_time = DateTimeField(
+        'start_time',
+        validators=[Optional()],
+        format=['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M']
+    )
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)],
+        default=120
+    )
+
+# ShowForm for a whole tour: one artist, many (venue_id, start_time) dates; blank rows are ignored
+class TourForm(Form):
+    artist_id = StringField(
+        'artist_id', validators=[DataRequired()]
+    )
+    dates = FieldList(
+        FormField(TourDateForm),
+        min_entries=10,
+        max_entries=200
     )
 
 class VenueForm(Form):
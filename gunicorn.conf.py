@@ -0,0 +1,16 @@
+import os
+
+# gunicorn reads this file from the directory it is started in, for the
+# sync workers (`gunicorn -w 4 'app:create_app()'`) as for the uvicorn ones
+# (see asgi.py). Settings stay on the command line; these are only hooks.
+
+
+def child_exit(server, worker):
+    # the pool gauges in metrics.py sum over live workers only: without this a
+    # dead worker's checked-out connections stay in every scrape
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:
+            return
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,425 @@
+import base64
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import ssl
+import threading
+from urllib.parse import urljoin, urlsplit
+
+from flask import abort, current_app, g, redirect, send_file, url_for
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
+
+from assets import DIST, IMMUTABLE, static_url
+from models import db, Venue, Artist
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+except ImportError:
+    Image = None
+
+
+# Responsive images. responsive_image() renders a <picture> whose sources
+# are resized derivatives at IMAGE_WIDTHS, as AVIF, WebP and JPEG, so the
+# browser downloads the smallest file that fills the slot. Derivatives
+# are made on first request from a file under app/static or from a
+# remote image_link, and kept in an on-disk ImageStore.
+#
+# Only files under app/static and URLs some venue or artist links to are
+# processed, and remote images are only fetched from public addresses.
+# Without Pillow the helper renders plain <img> tags pointing at the
+# originals.
+
+# (Pillow format, mimetype, save options), smallest first
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', {'quality': 50}),
+    'webp': ('WEBP', 'image/webp', {'quality': 75, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+# named `sizes` for the layouts' image slots
+SIZES = {
+    'tile': '(min-width: 1200px) 360px, (min-width: 768px) 33vw, 100vw',
+    'half': '(min-width: 1200px) 555px, (min-width: 768px) 50vw, 100vw',
+    'full': '100vw',
+}
+
+# rendered ahead of time by `flask fyyur build-images`
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# the fallback <img src> is the JPEG closest to this width
+FALLBACK_WIDTH = 640
+
+
+def available_formats():
+    if Image is None:
+        return []
+    return [name for name, (format, _, _) in FORMATS.items() if format == 'JPEG' or features.check(format.lower())]
+
+
+#----------------------------------------------------------------------------#
+# Store.
+#----------------------------------------------------------------------------#
+
+class ImageStore:
+    """Files under `root` up to `max_bytes`, evicting the least recently used.
+
+    Reads bump a file's mtime, so the eviction order survives restarts and
+    is shared by every worker using the directory. Each process keeps its
+    own running total and rescans the directory when it goes over the cap.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """The path of a stored file, or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, content):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(content)
+        os.replace(temporary, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += len(content)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _scan(self):
+        files, total = [], 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return files, total
+
+    def _evict(self):
+        # down to 90% of the cap, so a full store does not rescan on every put
+        files, total = self._scan()
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+#----------------------------------------------------------------------------#
+# Processing.
+#----------------------------------------------------------------------------#
+
+def render_derivative(original, width, format):
+    """`original` image bytes scaled down to at most `width` pixels wide, encoded as `format`."""
+    pillow_format, _, options = FORMATS[format]
+    with Image.open(io.BytesIO(original)) as image:
+        # JPEGs decode at a fraction of their size when that is all we need
+        image.draft('RGB', (width, max(1, image.height * width // image.width)))
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        if has_alpha and format == 'jpeg':
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        output = io.BytesIO()
+        image.save(output, pillow_format, **options)
+        return output.getvalue()
+
+
+#----------------------------------------------------------------------------#
+# Remote images.
+#----------------------------------------------------------------------------#
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class FetchError(Exception):
+    pass
+
+
+def _public_address(parts):
+    """An address of the URL's host, provided every address it resolves to is public."""
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise FetchError(f'not an http(s) URL: {parts.geturl()}')
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme], type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError) as error:
+        raise FetchError(f'cannot resolve {parts.hostname}: {error}')
+    addresses = [info[4][0] for info in infos]
+    for address in addresses:
+        if not ipaddress.ip_address(address.split('%')[0]).is_global:
+            raise FetchError(f'{parts.hostname} is not a public address')
+    return addresses[0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    # connects to the address that was checked rather than resolving the
+    # host again, which a rebinding DNS server could answer differently;
+    # the Host header still names the host
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout, context=ssl.create_default_context())
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        # the certificate is verified against the host name, not the address
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def fetch_image(url, timeout, max_bytes):
+    """The bytes of a remote image; raises FetchError for anything else.
+
+    Every hop, redirects included, goes only to public addresses.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        address = _public_address(parts)
+        connection_class = _PinnedHTTPSConnection if parts.scheme == 'https' else _PinnedHTTPConnection
+        connection = connection_class(parts.hostname, parts.port, address, timeout)
+        try:
+            path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+            connection.request('GET', path, headers={'User-Agent': 'fyyur-images/1.0', 'Accept': 'image/*'})
+            response = connection.getresponse()
+            if response.status in REDIRECTS and response.getheader('Location'):
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise FetchError(f'{url} answered {response.status}')
+            content_type = response.getheader('Content-Type', '').split(';')[0].strip().lower()
+            if not content_type.startswith('image/'):
+                raise FetchError(f'{url} is {content_type or "untyped"}, not an image')
+            content = response.read(max_bytes + 1)
+        except (OSError, http.client.HTTPException, ValueError) as error:
+            raise FetchError(f'cannot fetch {url}: {error}')
+        finally:
+            connection.close()
+        if len(content) > max_bytes:
+            raise FetchError(f'{url} is larger than {max_bytes} bytes')
+        return content
+    raise FetchError(f'{url}: more than {MAX_REDIRECTS} redirects')
+
+
+def is_linked(url):
+    """Whether any venue or artist shows this image; nothing else gets fetched."""
+    return db.session.query(
+        db.session.query(Venue.id).filter(Venue.image_link == url).exists()
+        | db.session.query(Artist.id).filter(Artist.image_link == url).exists()
+    ).scalar()
+
+
+#----------------------------------------------------------------------------#
+# Templates.
+#----------------------------------------------------------------------------#
+
+def _encode(source):
+    return base64.urlsafe_b64encode(source.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode(key):
+    return base64.urlsafe_b64decode(key + '=' * (-len(key) % 4)).decode('utf-8')
+
+
+def _source(src):
+    # ('remote', url) for image links, ('static', filename) for files under app/static
+    if urlsplit(src).scheme in ('http', 'https'):
+        return 'remote', src
+    return 'static', src
+
+
+def _static_version(filename):
+    # the fingerprint from the asset manifest when built, else the file's mtime
+    manifest = current_app.extensions.get('assets') or {}
+    if filename in manifest:
+        return manifest[filename]
+    try:
+        return str(int(os.stat(os.path.join(current_app.static_folder, filename)).st_mtime))
+    except (OSError, ValueError):
+        return ''
+
+
+def _original_url(kind, source):
+    if kind == 'remote':
+        return source
+    return static_url(source)
+
+
+def responsive_image(src, alt, sizes='full', lazy=True, **attrs):
+    """A <picture> of `src`, an image_link URL or a file under app/static, at every width and format."""
+    # a detail page repeats the same few images in hundreds of show tiles
+    rendered = g.setdefault('responsive_images', {})
+    key = (src, alt, sizes, lazy, *attrs.items())
+    try:
+        return rendered[key]
+    except KeyError:
+        markup = rendered[key] = _picture(src, alt, sizes, lazy, attrs)
+        return markup
+
+
+def _picture(src, alt, sizes, lazy, attrs):
+    attrs = {key.rstrip('_'): value for key, value in attrs.items()}
+    attrs.update(alt=alt)
+    if lazy:
+        attrs.update(loading='lazy', decoding='async')
+    if not src:
+        return Markup('<img {}>').format(Markup(_attributes(attrs)))
+
+    kind, source = _source(src)
+    formats = current_app.extensions['images']['formats']
+    if not formats:
+        attrs['src'] = _original_url(kind, source)
+        return Markup('<img {}>').format(Markup(_attributes(attrs)))
+
+    widths = current_app.config['IMAGE_WIDTHS']
+    sizes = SIZES.get(sizes, sizes)
+    params = {'kind': kind, 'key': _encode(source)}
+    if kind == 'static':
+        params['v'] = _static_version(source)
+
+    def srcset(format):
+        return ', '.join(f'{url_for("image", width=width, format=format, **params)} {width}w' for width in widths)
+
+    parts = ['<picture>']
+    for format in formats:
+        if format != 'jpeg':
+            parts.append(f'<source type="{FORMATS[format][1]}" srcset="{escape(srcset(format))}" sizes="{escape(sizes)}">')
+    fallback = min(widths, key=lambda width: abs(width - FALLBACK_WIDTH))
+    attrs.update(src=url_for('image', width=fallback, format='jpeg', **params), srcset=srcset('jpeg'), sizes=sizes)
+    parts.append(f'<img {_attributes(attrs)}>')
+    parts.append('</picture>')
+    return Markup(''.join(parts))
+
+
+def _attributes(attrs):
+    return ' '.join(f'{name}="{escape(value)}"' for name, value in attrs.items())
+
+
+#----------------------------------------------------------------------------#
+# Serving.
+#----------------------------------------------------------------------------#
+
+def _key(*parts):
+    return hashlib.sha256(':'.join(map(str, parts)).encode('utf-8')).hexdigest()
+
+
+def _load_original(kind, source):
+    app = current_app
+    if kind == 'static':
+        path = safe_join(app.static_folder, source)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    store = app.extensions['images']['store']
+    key = _key('original', source)
+    path = store.get(key)
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read()
+    if not is_linked(source):
+        abort(404)
+    config = app.config
+    content = fetch_image(source, config['IMAGE_FETCH_TIMEOUT'], config['IMAGE_FETCH_MAX_MB'] * 1024 * 1024)
+    store.put(key, content)
+    return content
+
+
+def derivative(kind, source, width, format):
+    """The path of `source` at `width` as `format`, rendered and stored on first use."""
+    store = current_app.extensions['images']['store']
+    # static files are keyed by version, so an edited file gets new derivatives
+    version = _static_version(source) if kind == 'static' else ''
+    key = _key(kind, source, version, width, format)
+    path = store.get(key)
+    if path is None:
+        path = store.put(key, render_derivative(_load_original(kind, source), width, format))
+    return path
+
+
+def static_images(static_folder):
+    """Source names of the images under app/static, outside the asset build."""
+    for directory, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = sorted(d for d in dirnames if os.path.join(directory, d) != os.path.join(static_folder, DIST))
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(directory, filename), static_folder).replace(os.sep, '/')
+
+
+def setup_images(app):
+    config = app.config
+    root = config['IMAGE_CACHE_DIR'] or os.path.join(app.instance_path, 'images')
+    store = ImageStore(root, config['IMAGE_CACHE_MAX_MB'] * 1024 * 1024)
+    app.extensions['images'] = {'store': store, 'formats': available_formats()}
+    app.jinja_env.globals['responsive_image'] = responsive_image
+
+    @app.route('/images/<kind>/<key>/<int:width>.<format>')
+    def image(kind, key, width, format):
+        if kind not in ('static', 'remote') or width not in config['IMAGE_WIDTHS'] \
+                or format not in app.extensions['images']['formats']:
+            abort(404)
+        try:
+            source = _decode(key)
+        except ValueError:
+            abort(404)
+
+        try:
+            path = derivative(kind, source, width, format)
+        except (FetchError, UnidentifiedImageError, OSError, ValueError) as error:
+            app.logger.warning('image %s could not be resized: %s', source, error)
+            if kind == 'remote':
+                # the page still shows the image, as before derivatives
+                return redirect(source)
+            abort(404)
+
+        response = send_file(path, mimetype=FORMATS[format][1], conditional=True)
+        # a static file gets a new URL when it changes; remote ones may change in place
+        response.headers['Cache-Control'] = IMMUTABLE if kind == 'static' else 'public, max-age=86400'
+        return response
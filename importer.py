@@ -0,0 +1,272 @@
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import MultiDict
+
+import clock
+from counters import recount_show_counters
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, Genre, venue_genre, artist_genre, DEFAULT_SHOW_DURATION
+from scheduling import clashes
+
+
+# For each importable kind: the model, the form whose rules every row must
+# pass, the genre link table (if any) and the boolean columns.
+KINDS = {
+    'venue': (Venue, VenueForm, venue_genre, ('seeking_talent',)),
+    'artist': (Artist, ArtistForm, artist_genre, ('seeking_venue',)),
+    'show': (Show, ShowForm, None, ()),
+}
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'on')
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+
+#----------------------------------------------------------------------------#
+# Reading.
+#----------------------------------------------------------------------------#
+
+def read_rows(stream, format):
+    """Yield (line number, dict) pairs from a CSV or NDJSON text stream, lazily."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_num, json.loads(line)
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def _form_data(row, booleans):
+    # turn one input row into the formdata the matching form expects
+    data = MultiDict()
+    for key, value in row.items():
+        if value is None or value == '':
+            continue
+        if key == 'genres':
+            if isinstance(value, str):
+                value = value.strip('{}').split(',')
+            for genre in value:
+                data.add(key, genre.strip().strip('"'))
+        elif key in booleans:
+            if str(value).lower() in TRUE_VALUES:
+                data[key] = 'y'
+        elif key == 'start_time' and isinstance(value, str) and 'T' in value:
+            # accept ISO timestamps such as the ones `flask fyyur export` writes
+            data[key] = datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+        elif key == 'end_time' and 'duration' not in row:
+            # exports carry end_time; the form takes a duration in minutes
+            duration = _as_datetime(value) - _as_datetime(row['start_time'])
+            data['duration'] = str(int(duration.total_seconds() // 60))
+        else:
+            data[key] = str(value)
+    return data
+
+
+def validate(kind, row):
+    """The insertable values of one row, or the form's errors."""
+    model, form_class, link, booleans = KINDS[kind]
+    try:
+        formdata = _form_data(row, booleans)
+        if kind == 'show':
+            # without this an absent start_time would silently take the form's default
+            formdata.setdefault('start_time', '')
+        form = form_class(formdata=formdata, meta={'csrf': False})
+    except (ValueError, TypeError, KeyError) as error:
+        return None, {'start_time': [str(error)]}
+    if not form.validate():
+        return None, form.errors
+
+    values = {name: field.data for name, field in form._fields.items()}
+    if kind == 'show':
+        try:
+            values['venue_id'] = int(values['venue_id'])
+            values['artist_id'] = int(values['artist_id'])
+        except (TypeError, ValueError):
+            return None, {'venue_id': ['Must be an integer.'], 'artist_id': ['Must be an integer.']}
+        if values['duration'] is None:
+            values['duration'] = DEFAULT_SHOW_DURATION // timedelta(minutes=1)
+    return values, None
+
+
+#----------------------------------------------------------------------------#
+# Writing.
+#----------------------------------------------------------------------------#
+
+def _allocate_ids(table, count):
+    # ids are handed out up front so genre links can be written in the same batch
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        return list(connection.execute(
+            db.text(f"SELECT nextval(pg_get_serial_sequence('{table.name}', 'id')) FROM generate_series(1, :count)"),
+            {'count': count},
+        ).scalars())
+    start = connection.execute(db.select(db.func.coalesce(db.func.max(table.c.id), 0))).scalar() + 1
+    return list(range(start, start + count))
+
+
+def _copy(table, columns, rows):
+    # Postgres COPY: one round trip for the whole batch
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def _insert(table, columns, rows, use_copy):
+    if not rows:
+        return
+    if use_copy:
+        _copy(table, columns, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+class Importer:
+    """Validates rows and writes them in batches of `batch_size` per transaction."""
+
+    def __init__(self, kind, batch_size=1000, use_copy=None, on_reject=None):
+        self.kind = kind
+        self.model, self.form_class, self.link, _ = KINDS[kind]
+        self.batch_size = batch_size
+        if use_copy is None:
+            use_copy = db.engine.url.get_backend_name() == 'postgresql'
+        self.use_copy = use_copy
+        self.on_reject = on_reject
+        self.stats = ImportStats()
+        self._genre_ids = None
+        self.touched_venues = set()
+        self.touched_artists = set()
+
+    def run(self, rows):
+        batch = []
+        for line_num, row in rows:
+            self.stats.read += 1
+            values, errors = validate(self.kind, row)
+            if errors:
+                self.reject(line_num, row, errors)
+                continue
+            batch.append((line_num, row, values))
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        self.flush(batch)
+        return self.stats
+
+    def reject(self, line_num, row, errors):
+        self.stats.rejected += 1
+        if self.on_reject is not None:
+            self.on_reject(line_num, row, errors)
+
+    def flush(self, batch):
+        if not batch:
+            return
+        if self.kind == 'show':
+            batch = self._unbooked(self._known_references(batch))
+        try:
+            inserted = self._write([values for _, _, values in batch])
+            if self.kind == 'show':
+                recount_show_counters(self.touched_venues, self.touched_artists)
+                self.touched_venues.clear()
+                self.touched_artists.clear()
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            self._genre_ids = None
+            for line_num, row, _ in batch:
+                self.reject(line_num, row, {'batch': [str(error).splitlines()[0]]})
+            return
+        self.stats.inserted += inserted
+
+    def _known_references(self, batch):
+        # one IN query per side instead of letting a foreign key abort the batch
+        venue_ids = {values['venue_id'] for _, _, values in batch}
+        artist_ids = {values['artist_id'] for _, _, values in batch}
+        known_venues = {id for id, in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))}
+        known_artists = {id for id, in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids))}
+        kept = []
+        for line_num, row, values in batch:
+            errors = {}
+            if values['venue_id'] not in known_venues:
+                errors['venue_id'] = ['No such venue.']
+            if values['artist_id'] not in known_artists:
+                errors['artist_id'] = ['No such artist.']
+            if errors:
+                self.reject(line_num, row, errors)
+            else:
+                kept.append((line_num, row, values))
+        return kept
+
+    def _unbooked(self, batch):
+        # one range query per batch, so a double booking costs its own row rather than the batch
+        kept = []
+        rows = [dict(values, end_time=values['start_time'] + timedelta(minutes=values['duration']))
+                for _, _, values in batch]
+        for (line_num, row, values), error in zip(batch, clashes(rows)):
+            if error:
+                self.reject(line_num, row, {'start_time': [error]})
+            else:
+                kept.append((line_num, row, values))
+        return kept
+
+    def _genre_id(self, name):
+        if self._genre_ids is None:
+            self._genre_ids = {genre.name: genre.id for genre in Genre.query}
+        if name not in self._genre_ids:
+            self._genre_ids[name] = db.session.execute(
+                Genre.__table__.insert().values(name=name)
+            ).inserted_primary_key[0]
+        return self._genre_ids[name]
+
+    def _write(self, rows):
+        table = self.model.__table__
+        now = clock.timestamp()
+        if self.kind == 'show':
+            columns = ['venue_id', 'artist_id', 'start_time', 'end_time', 'updated_at']
+            records = [
+                dict(row, end_time=row['start_time'] + timedelta(minutes=row['duration']), updated_at=now)
+                for row in rows
+            ]
+            self.touched_venues.update(row['venue_id'] for row in rows)
+            self.touched_artists.update(row['artist_id'] for row in rows)
+            _insert(table, columns, records, self.use_copy)
+            return len(records)
+
+        columns = [name for name in rows[0] if name != 'genres'] + ['id', 'updated_at']
+        ids = _allocate_ids(table, len(rows))
+        records, links = [], []
+        key = f'{table.name}_id'
+        for id, row in zip(ids, rows):
+            records.append(dict({name: row[name] for name in columns[:-2]}, id=id, updated_at=now))
+            for genre in dict.fromkeys(row['genres']):
+                links.append({'genre_id': self._genre_id(genre), key: id})
+        _insert(table, columns, records, self.use_copy)
+        _insert(self.link, ['genre_id', key], links, self.use_copy)
+        return len(records)
@@ -0,0 +1,117 @@
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, render_template, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Per-request SQL accounting. Every statement any engine runs inside a
+# request is timed through the cursor events; after the request the totals
+# go out as a Server-Timing header, repeated statement shapes are reported
+# as suspected N+1 queries, and in test mode a request that runs more than
+# SQL_QUERY_BUDGET statements fails.
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETER = r'(?:\?|%s|%\(\w+\)s|:\w+)'
+_PARAMETER_LISTS = re.compile(rf'\(\s*{_PARAMETER}(?:\s*,\s*{_PARAMETER})*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+# statements kept per request for the debug panel
+MAX_LOGGED_STATEMENTS = 200
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    """The statement with literals and IN lists folded, so loops of lookups compare equal."""
+    shape = _LITERALS.sub('?', statement)
+    shape = _PARAMETER_LISTS.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryLog:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.statements = []
+        self.started = time.perf_counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+        if len(self.statements) < MAX_LOGGED_STATEMENTS:
+            self.statements.append((statement, duration))
+
+    def repeated(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def current_log():
+    """The query log of the current request, or None outside requests."""
+    if not has_request_context():
+        return None
+    if 'query_log' not in g:
+        g.query_log = QueryLog()
+    return g.query_log
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_started'].pop()
+    log = current_log()
+    if log is not None:
+        log.record(statement, duration)
+
+
+def _server_timing(log):
+    elapsed = (time.perf_counter() - log.started) * 1000
+    return f'db;dur={log.duration * 1000:.2f};desc="{log.count} queries", app;dur={elapsed:.2f}'
+
+
+def setup_instrumentation(app):
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+    # listening on Engine covers the primary and every replica
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_query_log():
+        g.query_log = QueryLog()
+
+    @app.after_request
+    def report_queries(response):
+        log = current_log()
+        # streamed bodies run their queries after this point and are not counted
+        response.headers['Server-Timing'] = _server_timing(log)
+
+        repeated = log.repeated(app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+        for shape, count in repeated:
+            app.logger.warning('Suspected N+1 in %s %s: %d x %s', request.method, request.path, count, shape)
+
+        budget = app.config['SQL_QUERY_BUDGET']
+        if app.testing and budget and log.count > budget:
+            raise QueryBudgetExceeded(
+                f'{request.method} {request.path} ran {log.count} queries, over the budget of {budget}'
+            )
+
+        if (
+            app.config['SQL_DEBUG_PANEL'] and response.mimetype == 'text/html'
+            and not response.is_streamed and response.status_code == 200
+        ):
+            body = response.get_data(as_text=True)
+            if '</body>' in body:
+                panel = render_template('debug/sql_panel.html', log=log, repeated=repeated)
+                response.set_data(body.replace('</body>', panel + '</body>', 1))
+        return response
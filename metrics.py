@@ -0,0 +1,139 @@
+import os
+import time
+
+from flask import Response, before_render_template, g, request, template_rendered
+from sqlalchemy import event
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
+
+
+# Prometheus metrics served at /metrics. Values live in prometheus_client,
+# which keeps them in process memory, or, when PROMETHEUS_MULTIPROC_DIR is
+# set before the app starts (as it must be under several gunicorn workers),
+# in per-process mmap files under that directory that every scrape merges.
+# The directory has to be emptied before the workers start, and gunicorn
+# has to run the child_exit hook in gunicorn.conf.py, which drops a dead
+# worker's files from the livesum pool gauges.
+
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = Histogram(
+        'fyyur_request_duration_seconds', 'Request latency.', ['method', 'route'],
+    )
+    REQUESTS = Counter(
+        'fyyur_requests_total', 'Requests served.', ['method', 'route', 'status'],
+    )
+    REQUEST_DB_TIME = Histogram(
+        'fyyur_request_db_seconds', 'Time spent in SQL per request.', ['route'],
+        buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+    )
+    REQUEST_QUERIES = Histogram(
+        'fyyur_request_queries', 'SQL statements per request.', ['route'],
+        buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55),
+    )
+    TEMPLATE_RENDER_TIME = Histogram(
+        'fyyur_template_render_seconds', 'Jinja render time.', ['template'],
+        buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25),
+    )
+    CACHE_LOOKUPS = Counter(
+        'fyyur_cache_lookups_total', 'Response cache lookups.', ['result'],
+    )
+    POOL_CHECKED_OUT = Gauge(
+        'fyyur_db_pool_checked_out', 'Connections checked out of the pool.', ['engine'],
+        multiprocess_mode='livesum',
+    )
+    POOL_OVERFLOW = Gauge(
+        'fyyur_db_pool_overflow', 'Connections open beyond the pool size.', ['engine'],
+        multiprocess_mode='livesum',
+    )
+    POOL_CHECKOUTS = Counter(
+        'fyyur_db_pool_checkouts_total', 'Pool checkouts.', ['engine'],
+    )
+    POOL_WAIT = Counter(
+        'fyyur_db_pool_wait_seconds_total', 'Time checkouts spent waiting for a connection.', ['engine'],
+    )
+
+
+def record_cache_lookup(hit):
+    if prometheus_client is not None:
+        CACHE_LOOKUPS.labels('hit' if hit else 'miss').inc()
+
+
+def _route():
+    # the URL rule, not the path, so /venues/1 and /venues/2 share a series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _watch_pool(name, engine):
+    waited = {'total': 0.0}
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(*args):
+        pool = engine.pool
+        POOL_CHECKED_OUT.labels(name).inc()
+        POOL_CHECKOUTS.labels(name).inc()
+        if hasattr(pool, 'overflow'):
+            POOL_OVERFLOW.labels(name).set(max(pool.overflow(), 0))
+        # TimedQueuePool keeps a running total; pass on what this checkout added
+        wait_total = getattr(pool, 'wait_total', 0.0)
+        if wait_total > waited['total']:
+            POOL_WAIT.labels(name).inc(wait_total - waited['total'])
+        waited['total'] = wait_total
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(*args):
+        POOL_CHECKED_OUT.labels(name).dec()
+
+
+def _on_before_render(app, template, context):
+    g.setdefault('template_started', []).append(time.perf_counter())
+
+
+def _on_rendered(app, template, context):
+    started = g.get('template_started')
+    if started:
+        TEMPLATE_RENDER_TIME.labels(template.name or 'string').observe(time.perf_counter() - started.pop())
+
+
+def setup_metrics(app, db):
+    if prometheus_client is None:
+        app.logger.info('prometheus_client is not installed; /metrics is disabled')
+        return
+
+    for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+        _watch_pool(bind or 'primary', db.get_engine(app, bind=bind))
+
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        route = _route()
+        if 'request_started' in g:
+            REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - g.request_started)
+        REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+        log = g.get('query_log')
+        if log is not None:
+            REQUEST_DB_TIME.labels(route).observe(log.duration)
+            REQUEST_QUERIES.labels(route).observe(log.count)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if MULTIPROCESS:
+            from prometheus_client import multiprocess
+
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
@@ -0,0 +1,103 @@
+"""normalize genres into genre, venue_genre and artist_genre
+
+Revision ID: 3f6b2c9d1e47
+Revises: 81fc3e7a3bcb
+Create Date: 2026-10-18 10:12:05.412883
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b2c9d1e47'
+down_revision = '81fc3e7a3bcb'
+branch_labels = None
+depends_on = None
+
+
+def _parse_genres(value):
+    # the old columns hold a postgres array literal such as '{Jazz,"Rock n Roll"}'
+    if not value:
+        return []
+    names = value.strip().lstrip('{').rstrip('}').split(',')
+    return [name.strip().strip('"') for name in names if name.strip().strip('"')]
+
+
+def _backfill(connection, table, link_table, key):
+    genre_ids = {row.name: row.id for row in connection.execute(sa.text('SELECT id, name FROM genre'))}
+    rows = connection.execute(sa.text(f'SELECT id, genres FROM {table}')).fetchall()
+    links = []
+    for row in rows:
+        for name in dict.fromkeys(_parse_genres(row.genres)):
+            if name not in genre_ids:
+                genre_ids[name] = connection.execute(
+                    sa.text('INSERT INTO genre (name) VALUES (:name) RETURNING id'), {'name': name}
+                ).scalar()
+            links.append({'genre_id': genre_ids[name], key: row.id})
+    if links:
+        connection.execute(
+            sa.text(f'INSERT INTO {link_table} (genre_id, {key}) VALUES (:genre_id, :{key})'), links
+        )
+
+
+def _restore(connection, table, link_table, key):
+    rows = connection.execute(sa.text(
+        f'SELECT {link_table}.{key} AS id, genre.name AS name FROM {link_table} '
+        f'JOIN genre ON genre.id = {link_table}.genre_id ORDER BY {link_table}.{key}, genre.name'
+    )).fetchall()
+    genres = {}
+    for row in rows:
+        genres.setdefault(row.id, []).append(row.name)
+    for entity_id, names in genres.items():
+        connection.execute(
+            sa.text(f'UPDATE {table} SET genres = :genres WHERE id = :id'),
+            {'genres': '{' + ','.join(names) + '}', 'id': entity_id},
+        )
+
+
+def upgrade():
+    op.create_table('genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('venue_genre',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('genre_id', 'venue_id')
+    )
+    op.create_index(op.f('ix_venue_genre_venue_id'), 'venue_genre', ['venue_id'], unique=False)
+    op.create_table('artist_genre',
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ),
+    sa.PrimaryKeyConstraint('genre_id', 'artist_id')
+    )
+    op.create_index(op.f('ix_artist_genre_artist_id'), 'artist_genre', ['artist_id'], unique=False)
+
+    connection = op.get_bind()
+    _backfill(connection, 'venue', 'venue_genre', 'venue_id')
+    _backfill(connection, 'artist', 'artist_genre', 'artist_id')
+
+    op.drop_column('venue', 'genres')
+    op.drop_column('artist', 'genres')
+
+
+def downgrade():
+    op.add_column('artist', sa.Column('genres', sa.VARCHAR(length=120), autoincrement=False, nullable=True))
+    op.add_column('venue', sa.Column('genres', sa.VARCHAR(length=500), autoincrement=False, nullable=True))
+
+    connection = op.get_bind()
+    _restore(connection, 'venue', 'venue_genre', 'venue_id')
+    _restore(connection, 'artist', 'artist_genre', 'artist_id')
+
+    op.drop_index(op.f('ix_artist_genre_artist_id'), table_name='artist_genre')
+    op.drop_table('artist_genre')
+    op.drop_index(op.f('ix_venue_genre_venue_id'), table_name='venue_genre')
+    op.drop_table('venue_genre')
+    op.drop_table('genre')
@@ -0,0 +1,56 @@
+"""search indexes on venue.name and artist.name
+
+Revision ID: 5a1d7e3c9b20
+Revises: 3f6b2c9d1e47
+Create Date: 2026-10-18 11:03:47.920154
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1d7e3c9b20'
+down_revision = '3f6b2c9d1e47'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('venue', 'artist')
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in TABLES:
+            op.create_index(f'ix_{table}_name_trgm', table, ['name'], postgresql_using='gin',
+                            postgresql_ops={'name': 'gin_trgm_ops'})
+            op.execute(f"CREATE INDEX ix_{table}_name_tsv ON {table} "
+                       f"USING gin (to_tsvector('simple', coalesce(name, '')))")
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            op.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5("
+                       f"name, content='{table}', content_rowid='id', tokenize='trigram')")
+            op.execute(f"CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {table}_fts(rowid, name) VALUES (new.id, new.name); END")
+            op.execute(f"CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {table}_fts({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); END")
+            op.execute(f"CREATE TRIGGER {table}_fts_au AFTER UPDATE OF name ON {table} BEGIN "
+                       f"INSERT INTO {table}_fts({table}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+                       f"INSERT INTO {table}_fts(rowid, name) VALUES (new.id, new.name); END")
+            # index the rows that already exist
+            op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table in TABLES:
+            op.execute(f'DROP INDEX ix_{table}_name_tsv')
+            op.drop_index(f'ix_{table}_name_trgm', table_name=table)
+    elif dialect == 'sqlite':
+        for table in TABLES:
+            for trigger in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER {table}_fts_{trigger}')
+            op.execute(f'DROP TABLE {table}_fts')
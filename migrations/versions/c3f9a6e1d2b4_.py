@@ -0,0 +1,33 @@
+"""updated_at on venue, artist and show
+
+Revision ID: c3f9a6e1d2b4
+Revises: b7e2d4a91c58
+Create Date: 2026-10-18 13:05:12.771904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9a6e1d2b4'
+down_revision = 'b7e2d4a91c58'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('venue', 'artist', 'show')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP')
+        # SQLite cannot alter columns in place, and rebuilding venue/artist would drop the search triggers
+        if op.get_bind().dialect.name != 'sqlite':
+            op.alter_column(table, 'updated_at', nullable=False, server_default=sa.func.now())
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,27 @@
+"""server-side default for show.start_time
+
+Revision ID: e4b1c7d92a65
+Revises: c3f9a6e1d2b4
+Create Date: 2026-10-18 20:02:37.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b1c7d92a65'
+down_revision = 'c3f9a6e1d2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite cannot alter columns in place; the app-side default covers it there
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('show', 'start_time', server_default=sa.func.now())
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        op.alter_column('show', 'start_time', server_default=None)
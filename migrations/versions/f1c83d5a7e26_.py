@@ -0,0 +1,83 @@
+"""show.end_time and no double booking of venues or artists
+
+Revision ID: f1c83d5a7e26
+Revises: e4b1c7d92a65
+Create Date: 2026-10-18 21:14:52.630917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c83d5a7e26'
+down_revision = 'e4b1c7d92a65'
+branch_labels = None
+depends_on = None
+
+
+# copies of the DDL in scheduling.py, as of this revision
+SIDES = (('show_venue_no_overlap', 'venue'), ('show_artist_no_overlap', 'artist'))
+MAX_SHOW_SECONDS = 24 * 60 * 60
+
+
+def _sqlite_trigger(name, event_clause, exclude_self):
+    checks = ' '.join(
+        f"SELECT RAISE(ABORT, '{constraint}') WHERE EXISTS ("
+        f"SELECT 1 FROM show WHERE {side}_id = NEW.{side}_id"
+        f" AND start_time > datetime(NEW.start_time, '-{MAX_SHOW_SECONDS} seconds')"
+        f" AND start_time < NEW.end_time AND end_time > NEW.start_time"
+        f"{' AND id != NEW.id' if exclude_self else ''});"
+        for constraint, side in SIDES
+    )
+    return f"CREATE TRIGGER {name} BEFORE {event_clause} ON show BEGIN {checks} END"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    # existing shows get the default length of two hours
+    with op.batch_alter_table('show', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('end_time', sa.DateTime(), nullable=True))
+    if dialect == 'postgresql':
+        op.execute("UPDATE show SET end_time = start_time + interval '2 hours'")
+    else:
+        op.execute("UPDATE show SET end_time = datetime(start_time, '+2 hours')")
+
+    with op.batch_alter_table('show', schema=None) as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_check_constraint('ck_show_end_after_start', 'end_time > start_time')
+
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for constraint, side in SIDES:
+            overlaps = op.get_bind().execute(sa.text(
+                f'SELECT a.id, b.id FROM show a JOIN show b ON a.{side}_id = b.{side}_id AND a.id < b.id '
+                'AND tsrange(a.start_time, a.end_time) && tsrange(b.start_time, b.end_time) LIMIT 10'
+            )).fetchall()
+            if overlaps:
+                pairs = ', '.join(f'{a}/{b}' for a, b in overlaps)
+                raise RuntimeError(
+                    f'cannot add {constraint}: these shows double-book a {side} and must be '
+                    f'moved or deleted first (show ids): {pairs}'
+                )
+            op.execute(
+                f'ALTER TABLE show ADD CONSTRAINT {constraint} EXCLUDE USING gist '
+                f'({side}_id WITH =, tsrange(start_time, end_time) WITH &&)'
+            )
+    elif dialect == 'sqlite':
+        op.execute(_sqlite_trigger('show_no_overlap_bi', 'INSERT', False))
+        op.execute(_sqlite_trigger('show_no_overlap_bu', 'UPDATE OF venue_id, artist_id, start_time, end_time', True))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for constraint, _ in SIDES:
+            op.execute(f'ALTER TABLE show DROP CONSTRAINT {constraint}')
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER show_no_overlap_bi')
+        op.execute('DROP TRIGGER show_no_overlap_bu')
+
+    with op.batch_alter_table('show', schema=None) as batch_op:
+        batch_op.drop_constraint('ck_show_end_after_start', type_='check')
+        batch_op.drop_column('end_time')
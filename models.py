@@ -1,22 +1,262 @@
-from flask_sqlalchemy import SQLAlchemy
+import itertools
+import threading
+import time
+from datetime import timedelta
+
+from flask import has_request_context, jsonify, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask_migrate import Migrate
-from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
+import clock
 from config import SQLALCHEMY_DATABASE_URI
 
+
+#----------------------------------------------------------------------------#
+# Engines and sessions.
+#----------------------------------------------------------------------------#
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+class ReplicaSet:
+    """An app's read replicas and the policy that picks one for each request.
+
+    round-robin rotates through them; least-connections takes the replica
+    with the fewest connections this process has checked out.
+    """
+
+    def __init__(self, binds, policy='round-robin'):
+        self.binds = list(binds)
+        self.policy = policy
+        self.in_use = dict.fromkeys(self.binds, 0)
+        self._turn = itertools.count()
+        self._watched = set()
+        self._lock = threading.Lock()
+
+    def _watch(self, bind, engine):
+        if bind in self._watched:
+            return
+        self._watched.add(bind)
+
+        @event.listens_for(engine, 'checkout')
+        def checkout(*args):
+            with self._lock:
+                self.in_use[bind] += 1
+
+        @event.listens_for(engine, 'checkin')
+        def checkin(*args):
+            with self._lock:
+                self.in_use[bind] -= 1
+
+    def pick(self, db, app):
+        if self.policy == 'least-connections':
+            for bind in self.binds:
+                self._watch(bind, db.get_engine(app, bind=bind))
+            with self._lock:
+                bind = min(self.binds, key=self.in_use.get)
+        else:
+            bind = self.binds[next(self._turn) % len(self.binds)]
+        return bind
+
+
+class RoutingSession(SignallingSession):
+    """Sends the reads of GET requests to a replica and everything else to the primary.
+
+    One replica serves the whole request. Once the session writes it is
+    pinned to the primary, so later reads in the same request see the write,
+    and the client is asked to read from the primary for a few seconds more
+    (see setup_db) so the page it is redirected to does too.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        self.pinned = False
+        self._replica = None
+        super().__init__(db, **options)
+
+    def _reads_from_replica(self):
+        return (
+            'replicas' in self.app.extensions
+            and has_request_context() and request.method in ('GET', 'HEAD')
+            and not request.cookies.get(PRIMARY_COOKIE)
+        )
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.pinned = True
+        if not self.pinned and self._reads_from_replica():
+            if self._replica is None:
+                self._replica = self.app.extensions['replicas'].pick(self.db, self.app)
+            return self.db.get_engine(self.app, bind=self._replica)
+        return super().get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        config = app.config
+        options['pool_pre_ping'] = config['DB_POOL_PRE_PING']
+        # SQLite keeps the pool Flask-SQLAlchemy picks for it
+        if sa_url.get_backend_name() != 'sqlite':
+            options.update(
+                poolclass=TimedQueuePool,
+                pool_size=config['DB_POOL_SIZE'],
+                max_overflow=config['DB_MAX_OVERFLOW'],
+                pool_timeout=config['DB_POOL_TIMEOUT'],
+                pool_recycle=config['DB_POOL_RECYCLE'],
+            )
+        if config['DB_STATEMENT_TIMEOUT'] and sa_url.get_backend_name() == 'postgresql':
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"
+        return sa_url, options
+
+
 db_name = 'fyyur'
-db = SQLAlchemy()
+db = Database()
+
+# set on responses to requests that wrote; its requests read from the primary
+PRIMARY_COOKIE = 'fyyur_primary'
+
 
-def setup_db(app, db_uri=SQLALCHEMY_DATABASE_URI):
+def pool_stats(app):
+    """Checked-out connections, overflow and checkout waits for each engine."""
+    stats = {}
+    for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+        pool = db.get_engine(app, bind=bind).pool
+        entry = {'pool': type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                # overflow() counts up from -size until the pool is full
+                overflow=max(pool.overflow(), 0),
+            )
+        if isinstance(pool, TimedQueuePool):
+            entry.update(
+                checkouts=pool.checkouts,
+                wait_total=round(pool.wait_total, 6),
+                wait_max=round(pool.wait_max, 6),
+            )
+        stats[bind or 'primary'] = entry
+    return stats
+
+
+def setup_db(app, db_uri=SQLALCHEMY_DATABASE_URI, replica_uris=None):
     app.config.from_object('config')
     app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if replica_uris is None:
+        replica_uris = app.config['SQLALCHEMY_REPLICA_URIS']
+    if replica_uris:
+        binds = {f'replica{number}': uri for number, uri in enumerate(replica_uris, 1)}
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.extensions['replicas'] = ReplicaSet(binds, app.config['DB_REPLICA_POLICY'])
     db.app = app
     db.init_app(app)
     Migrate(app, db)
 
+    @app.after_request
+    def pin_to_primary(response):
+        if 'replicas' in app.extensions and db.session.registry.has() and db.session().pinned:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=app.config['DB_REPLICA_PIN_SECONDS'], httponly=True)
+        return response
+
+    @app.route('/db/pool')
+    def db_pool_stats():
+        return jsonify(pool_stats(app))
+
+
+#----------------------------------------------------------------------------#
+# Models.
+#----------------------------------------------------------------------------#
+
+venue_genre = db.Table('venue_genre',
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True),
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True, index=True),
+)
+
+artist_genre = db.Table('artist_genre',
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id'), primary_key=True),
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True, index=True),
+)
+
+
+class Genre(db.Model):
+    __tablename__ = 'genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def from_names(cls, names):
+        # resolve genre names to rows with one IN query, creating the missing ones
+        names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+        if not names:
+            return []
+        # genres created earlier in this session are not in the table yet
+        existing = {obj.name: obj for obj in db.session.new if isinstance(obj, cls)}
+        missing = [name for name in names if name not in existing]
+        if missing:
+            with db.session.no_autoflush:
+                existing.update((genre.name, genre) for genre in cls.query.filter(cls.name.in_(missing)))
+        genres = []
+        for name in names:
+            if name not in existing:
+                existing[name] = cls(name=name)
+                db.session.add(existing[name])
+            genres.append(existing[name])
+        return genres
+
 
-class Venue(db.Model):
+class GenresMixin:
+    # exposes the genre_items relationship as a plain list of genre names
+
+    @property
+    def genres(self):
+        return [genre.name for genre in self.genre_items]
+
+    @genres.setter
+    def genres(self, names):
+        self.genre_items = Genre.from_names(names or [])
+        # only the link table changes, so updated_at's onupdate would not fire
+        self.updated_at = clock.timestamp()
+
+
+def touch(model, ids):
+    # mark rows as changed when something they render (a show, a counterpart's name) changes
+    ids = list(ids)
+    if ids:
+        model.query.filter(model.id.in_(ids)).update({model.updated_at: clock.timestamp()}, synchronize_session=False)
+
+
+class Venue(GenresMixin, db.Model):
     __tablename__ = 'venue'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -25,17 +265,22 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(500))
+    genre_items = db.relationship('Genre', secondary=venue_genre, order_by='Genre.name')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    # denormalized show counters, see counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped on every write to the row, including counter updates; drives ETag / Last-Modified
+    updated_at = db.Column(db.DateTime, nullable=False, default=clock.timestamp, onupdate=clock.timestamp, server_default=db.func.now())
     shows = db.relationship('Show', backref='venue', lazy=True)
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
-class Artist(db.Model):
+class Artist(GenresMixin, db.Model):
     __tablename__ = 'artist'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -43,20 +288,53 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genre_items = db.relationship('Genre', secondary=artist_genre, order_by='Genre.name')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    # denormalized show counters, see counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped on every write to the row, including counter updates; drives ETag / Last-Modified
+    updated_at = db.Column(db.DateTime, nullable=False, default=clock.timestamp, onupdate=clock.timestamp, server_default=db.func.now())
     shows = db.relationship('Show', backref='artist', lazy=True)
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+# shows without an explicit end last this long; none may last longer than the
+# maximum, which bounds the overlap checks in scheduling.py
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+MAX_SHOW_DURATION = timedelta(hours=24)
+
+
+def _default_end_time(context):
+    return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
+
 class Show(db.Model):
+    __table_args__ = (
+        # detail pages and show counts filter on one side of the show plus start_time
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+        # the /shows feed walks (start_time, id) keyset pages
+        db.Index('ix_show_start_time_id', 'start_time', 'id'),
+        db.CheckConstraint('end_time > start_time', name='ck_show_end_after_start'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False, default=datetime.now())
+    start_time = db.Column(db.DateTime, nullable=False, default=clock.now, server_default=db.func.now())
+    # shows occupy [start_time, end_time); scheduling.py rejects overlapping bookings
+    end_time = db.Column(db.DateTime, nullable=False, default=_default_end_time)
+    updated_at = db.Column(db.DateTime, nullable=False, default=clock.timestamp, onupdate=clock.timestamp, server_default=db.func.now())
+
+    # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+
 
-    # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
\ No newline at end of file
+# The past/upcoming split over one :now parameter, built once and shared by
+# every query; bind it with .params(now=clock.now()).
+SHOW_UPCOMING = Show.start_time >= db.bindparam('now', type_=db.DateTime)
+SHOW_PAST = Show.start_time < db.bindparam('now', type_=db.DateTime)
@@ -0,0 +1,344 @@
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+import clock
+from models import db, Venue, Artist, Show, Genre, venue_genre, artist_genre, SHOW_UPCOMING, SHOW_PAST
+
+
+#----------------------------------------------------------------------------#
+# Genres.
+#----------------------------------------------------------------------------#
+
+def _genre_members(member_column, link_table, genre):
+    # ids linked to the named genre; served by the (genre_id, member) primary key
+    return db.session.query(member_column).join(
+        Genre, Genre.id == link_table.c.genre_id
+    ).filter(Genre.name == genre)
+
+
+#----------------------------------------------------------------------------#
+# Venues.
+#----------------------------------------------------------------------------#
+
+def venue_areas(genre=None):
+    """Every (city, state) area with its venues and per-venue upcoming show counts.
+
+    Counts come from the venue's upcoming_shows_count counter, so this is a
+    single scan of venue no matter how many cities, venues or shows exist.
+    `genre` narrows the venues through the venue_genre index.
+    """
+    query = db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows'),
+    )
+    if genre:
+        query = query.filter(Venue.id.in_(_genre_members(venue_genre.c.venue_id, venue_genre, genre)))
+    rows = query.order_by(
+        Venue.state, Venue.city, Venue.name, Venue.id
+    ).all()
+
+    areas = []
+    for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
+        areas.append({
+            "city": city,
+            "state": state,
+            "venues": [{
+                "id": venue.id,
+                "name": venue.name,
+                "num_upcoming_shows": venue.num_upcoming_shows,
+            } for venue in venues],
+        })
+    return areas
+
+
+#----------------------------------------------------------------------------#
+# Artists.
+#----------------------------------------------------------------------------#
+
+def artist_list(genre=None):
+    """The /artists listing, optionally narrowed to one genre."""
+    query = db.session.query(Artist.id, Artist.name)
+    if genre:
+        query = query.filter(Artist.id.in_(_genre_members(artist_genre.c.artist_id, artist_genre, genre)))
+    return [{"id": row.id, "name": row.name} for row in query.order_by(Artist.name, Artist.id)]
+
+
+#----------------------------------------------------------------------------#
+# Bulk reads.
+#----------------------------------------------------------------------------#
+
+ENTITY_FIELDS = {
+    Venue: (
+        'id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'image_link',
+        'facebook_link', 'website_link', 'seeking_talent', 'seeking_description',
+        'upcoming_shows_count', 'past_shows_count',
+    ),
+    Artist: (
+        'id', 'name', 'city', 'state', 'phone', 'genres', 'image_link',
+        'facebook_link', 'website_link', 'seeking_venue', 'seeking_description',
+        'upcoming_shows_count', 'past_shows_count',
+    ),
+}
+
+GENRE_LINKS = {Venue: venue_genre, Artist: artist_genre}
+
+
+def entity_page(model, fields, ids=None, after=None, limit=30, genre=None):
+    """Venues or artists as dicts of `fields`, keyset-paginated on id.
+
+    Only the requested columns are loaded, genres are selectin-loaded only
+    when asked for, and `ids` fetches a whole batch with one IN query.
+    Returns the rows and the cursor of the next page (None on the last one).
+    """
+    columns = [getattr(model, field) for field in fields if field not in ('id', 'genres')]
+    query = model.query.options(load_only(model.id, *columns))
+    if 'genres' in fields:
+        query = query.options(selectinload(model.genre_items))
+    if ids is not None:
+        query = query.filter(model.id.in_(ids))
+    if genre:
+        link = GENRE_LINKS[model]
+        query = query.filter(model.id.in_(_genre_members(link.c[f'{model.__tablename__}_id'], link, genre)))
+    if after is not None:
+        query = query.filter(model.id > after)
+
+    rows = query.order_by(model.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1].id)
+    return [{field: getattr(row, field) for field in fields} for row in rows], next_cursor
+
+
+#----------------------------------------------------------------------------#
+# Detail pages.
+#----------------------------------------------------------------------------#
+
+def _split_shows(shows, now):
+    # one pass over the already loaded shows against a single `now` snapshot
+    past_shows, upcoming_shows = [], []
+    for show in sorted(shows, key=lambda show: show.start_time):
+        if show.start_time < now:
+            past_shows.append(show)
+        else:
+            upcoming_shows.append(show)
+    return past_shows, upcoming_shows
+
+
+def venue_page(venue, genres, past_shows, upcoming_shows):
+    """The show_venue() page data from a venue row and its show dicts, however they were loaded."""
+    return {
+        "id": venue.id,
+        "name": venue.name,
+        "genres": genres,
+        "address": venue.address,
+        "city": venue.city,
+        "state": venue.state,
+        "phone": venue.phone,
+        "website_link": venue.website_link,
+        "facebook_link": venue.facebook_link,
+        "seeking_talent": venue.seeking_talent,
+        "seeking_description": venue.seeking_description,
+        "image_link": venue.image_link,
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": len(past_shows),
+        "upcoming_shows_count": len(upcoming_shows),
+    }
+
+
+def venue_detail(venue_id, now=None):
+    """The show_venue() page data, or None when the venue does not exist.
+
+    The venue is loaded joined to its few genres, then all of its shows
+    joined to their artist in one selectin pass, so the data costs two
+    statements however many shows there are; with the conditional() check
+    of updated_at the page stays at three.
+    """
+    if now is None:
+        now = clock.now()
+
+    venue = Venue.query.options(
+        selectinload(Venue.shows).joinedload(Show.artist),
+        joinedload(Venue.genre_items),
+    ).filter(Venue.id == venue_id).one_or_none()
+    if venue is None:
+        return None
+
+    def show_data(show):
+        return {
+            "artist_id": show.artist_id,
+            "artist_name": show.artist.name,
+            "artist_image_link": show.artist.image_link,
+            "start_time": show.start_time,
+        }
+
+    past_shows, upcoming_shows = _split_shows(venue.shows, now)
+    return venue_page(
+        venue, venue.genres,
+        [show_data(show) for show in past_shows], [show_data(show) for show in upcoming_shows],
+    )
+
+
+def artist_page(artist, genres, past_shows, upcoming_shows):
+    """The show_artist() page data from an artist row and its show dicts."""
+    return {
+        "id": artist.id,
+        "name": artist.name,
+        "genres": genres,
+        "city": artist.city,
+        "state": artist.state,
+        "phone": artist.phone,
+        "website": artist.website_link,
+        "facebook_link": artist.facebook_link,
+        "seeking_venue": artist.seeking_venue,
+        "seeking_description": artist.seeking_description,
+        "image_link": artist.image_link,
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": len(past_shows),
+        "upcoming_shows_count": len(upcoming_shows),
+    }
+
+
+def artist_detail(artist_id, now=None):
+    """The show_artist() page data, or None when the artist does not exist.
+
+    Mirrors venue_detail(): the artist, then its shows joined to their venue.
+    """
+    if now is None:
+        now = clock.now()
+
+    artist = Artist.query.options(
+        selectinload(Artist.shows).joinedload(Show.venue),
+        joinedload(Artist.genre_items),
+    ).filter(Artist.id == artist_id).one_or_none()
+    if artist is None:
+        return None
+
+    def show_data(show):
+        return {
+            "venue_id": show.venue_id,
+            "venue_name": show.venue.name,
+            "venue_image_link": show.venue.image_link,
+            "start_time": show.start_time,
+        }
+
+    past_shows, upcoming_shows = _split_shows(artist.shows, now)
+    return artist_page(
+        artist, artist.genres,
+        [show_data(show) for show in past_shows], [show_data(show) for show in upcoming_shows],
+    )
+
+
+#----------------------------------------------------------------------------#
+# Shows.
+#----------------------------------------------------------------------------#
+
+def encode_show_cursor(start_time, show_id):
+    return f'{start_time.isoformat()}_{show_id}'
+
+
+def decode_show_cursor(cursor):
+    """Inverse of encode_show_cursor(); raises ValueError on a malformed cursor."""
+    start_time, _, show_id = cursor.rpartition('_')
+    return datetime.fromisoformat(start_time), int(show_id)
+
+
+def _shows_query(when, now):
+    query = db.session.query(
+        Show.id,
+        Show.start_time,
+        Show.end_time,
+        Show.venue_id,
+        Venue.name.label('venue_name'),
+        Show.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+    ).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id)
+
+    # upcoming reads forward from now, past reads backwards from now
+    if when == 'upcoming':
+        return query.filter(SHOW_UPCOMING).params(now=now), False
+    if when == 'past':
+        return query.filter(SHOW_PAST).params(now=now), True
+    return query, False
+
+
+def _show_data(row):
+    return {
+        "id": row.id,
+        "venue_id": row.venue_id,
+        "venue_name": row.venue_name,
+        "artist_id": row.artist_id,
+        "artist_name": row.artist_name,
+        "artist_image_link": row.artist_image_link,
+        "start_time": row.start_time,
+        "end_time": row.end_time,
+    }
+
+
+def show_detail(show_id):
+    """One show with its venue and artist names, or None."""
+    query, _ = _shows_query('all', None)
+    row = query.filter(Show.id == show_id).one_or_none()
+    return None if row is None else _show_data(row)
+
+
+def show_page(when='all', after=None, limit=30, now=None):
+    """One keyset page of the /shows feed and the cursor of the next page.
+
+    Pages are ordered on (start_time, id); `after` is the cursor handed back
+    by the previous page, so every page costs one indexed range scan instead
+    of an OFFSET over the whole history.
+    """
+    if now is None:
+        now = clock.now()
+
+    query, descending = _shows_query(when, now)
+    if after is not None:
+        start_time, show_id = decode_show_cursor(after)
+        if descending:
+            query = query.filter(or_(
+                Show.start_time < start_time,
+                and_(Show.start_time == start_time, Show.id < show_id),
+            ))
+        else:
+            query = query.filter(or_(
+                Show.start_time > start_time,
+                and_(Show.start_time == start_time, Show.id > show_id),
+            ))
+    if descending:
+        query = query.order_by(Show.start_time.desc(), Show.id.desc())
+    else:
+        query = query.order_by(Show.start_time, Show.id)
+
+    # fetch one extra row to know whether there is a next page
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_show_cursor(rows[-1].start_time, rows[-1].id)
+    return [_show_data(row) for row in rows], next_cursor
+
+
+def iter_shows(when='all', now=None, batch_size=500):
+    """Yield the whole /shows feed lazily, fetching `batch_size` rows at a time."""
+    if now is None:
+        now = clock.now()
+
+    query, descending = _shows_query(when, now)
+    if descending:
+        query = query.order_by(Show.start_time.desc(), Show.id.desc())
+    else:
+        query = query.order_by(Show.start_time, Show.id)
+
+    query = query.execution_options(stream_results=True).yield_per(batch_size)
+    for row in query:
+        yield _show_data(row)
@@ -0,0 +1,179 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import DDL, and_, event, func
+
+from counters import recount_show_counters
+from models import db, Venue, Show, MAX_SHOW_DURATION
+
+
+# A venue or artist can only be in one show at a time. Shows occupy the
+# half-open range [start_time, end_time) and the database itself rejects
+# overlapping bookings, so two concurrent requests cannot both win:
+#
+#   Postgres: GiST exclusion constraints on (venue_id, tsrange) and
+#             (artist_id, tsrange); btree_gist provides the integer equality.
+#   SQLite:   BEFORE INSERT / UPDATE triggers probing the (venue_id,
+#             start_time) and (artist_id, start_time) indexes. Shows are
+#             capped at MAX_SHOW_DURATION, so the probe is a bounded range
+#             scan rather than a walk over every earlier show.
+#
+# The columns hold naive wall-clock times (see clock.py), hence tsrange
+# rather than tstzrange.
+
+# constraint (and SQLite trigger error) name -> the side that is double-booked
+CONSTRAINTS = {
+    'show_venue_no_overlap': 'venue',
+    'show_artist_no_overlap': 'artist',
+}
+
+
+def booking_conflict(error):
+    """'venue' or 'artist' when an IntegrityError is a double booking, else None."""
+    message = str(getattr(error, 'orig', error))
+    for name, side in CONSTRAINTS.items():
+        if name in message:
+            return side
+    return None
+
+
+def overlapping(start, end):
+    """Filter for shows overlapping [start, end), in the form the range index serves."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.tsrange(Show.start_time, Show.end_time).op('&&')(func.tsrange(start, end))
+    return and_(
+        Show.start_time > start - MAX_SHOW_DURATION,
+        Show.start_time < end,
+        Show.end_time > start,
+    )
+
+
+def clashes(rows):
+    """Why each of `rows` cannot be booked, or None where it can.
+
+    `rows` are dicts of venue_id, artist_id, start_time and end_time. Each
+    is checked against the shows already booked and against the rows before
+    it, with one range query however many rows there are.
+    """
+    if not rows:
+        return []
+    existing = db.session.query(Show.venue_id, Show.artist_id, Show.start_time, Show.end_time).filter(
+        db.or_(Show.venue_id.in_({row['venue_id'] for row in rows}),
+               Show.artist_id.in_({row['artist_id'] for row in rows})),
+        overlapping(min(row['start_time'] for row in rows), max(row['end_time'] for row in rows)),
+    ).all()
+    by_venue, by_artist = defaultdict(list), defaultdict(list)
+    for venue_id, artist_id, start_time, end_time in existing:
+        by_venue[venue_id].append((start_time, end_time))
+        by_artist[artist_id].append((start_time, end_time))
+
+    def taken(bookings, row):
+        return any(start_time < row['end_time'] and end_time > row['start_time'] for start_time, end_time in bookings)
+
+    errors = []
+    for row in rows:
+        if taken(by_artist[row['artist_id']], row):
+            errors.append('The artist is already booked at that time.')
+        elif taken(by_venue[row['venue_id']], row):
+            errors.append('The venue is already booked at that time.')
+        else:
+            errors.append(None)
+            # later rows must not clash with this one either
+            by_venue[row['venue_id']].append((row['start_time'], row['end_time']))
+            by_artist[row['artist_id']].append((row['start_time'], row['end_time']))
+    return errors
+
+
+def free_slots(venue_id, week_start, min_length=timedelta(0)):
+    """The gaps of at least `min_length` between the venue's shows in the week from `week_start`.
+
+    One index range scan over the week's shows, then a single pass.
+    """
+    week_end = week_start + timedelta(days=7)
+    booked = db.session.query(Show.start_time, Show.end_time).filter(
+        Show.venue_id == venue_id, overlapping(week_start, week_end),
+    ).order_by(Show.start_time).all()
+
+    slots = []
+    free_from = week_start
+    for start_time, end_time in booked + [(week_end, week_end)]:
+        if start_time > free_from and start_time - free_from >= min_length:
+            slots.append((free_from, min(start_time, week_end)))
+        free_from = max(free_from, end_time)
+    return slots
+
+
+def book_tour(artist_id, dates):
+    """Book one artist into many venues in the caller's transaction.
+
+    `dates` are dicts of venue_id, start_time and end_time. Returns them in
+    order with 'booked' and 'errors' added. Whatever the length of the tour
+    it costs one IN query for the venues, one range query for the bookings
+    in the way, one multi-row INSERT and the counter recount. Dates that
+    clash with an existing show or an earlier date of the tour are reported
+    and left out. A booking made concurrently still fails the INSERT with
+    an IntegrityError, for the caller to roll back.
+    """
+    results = [dict(date, booked=False, errors=[]) for date in dates]
+    if not results:
+        return results
+
+    venue_ids = {date['venue_id'] for date in results}
+    known_venues = {id for id, in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))}
+    for date in results:
+        if date['venue_id'] not in known_venues:
+            date['errors'].append('No such venue.')
+
+    candidates = [date for date in results if not date['errors']]
+    rows = []
+    for date, error in zip(candidates, clashes([dict(date, artist_id=artist_id) for date in candidates])):
+        if error:
+            date['errors'].append(error)
+        else:
+            date['booked'] = True
+            rows.append({'venue_id': date['venue_id'], 'artist_id': artist_id,
+                         'start_time': date['start_time'], 'end_time': date['end_time']})
+
+    if rows:
+        db.session.execute(Show.__table__.insert(), rows)
+        recount_show_counters({row['venue_id'] for row in rows}, [artist_id])
+    return results
+
+
+#----------------------------------------------------------------------------#
+# Constraints for databases built with db.create_all().
+# Migrated databases get the same objects from migration f1c83d5a7e26.
+#----------------------------------------------------------------------------#
+
+def _sqlite_trigger(name, event_clause, exclude_self):
+    checks = []
+    for constraint, side in CONSTRAINTS.items():
+        checks.append(
+            f"SELECT RAISE(ABORT, '{constraint}') WHERE EXISTS ("
+            f"SELECT 1 FROM show WHERE {side}_id = NEW.{side}_id"
+            f" AND start_time > datetime(NEW.start_time, '-{int(MAX_SHOW_DURATION.total_seconds())} seconds')"
+            f" AND start_time < NEW.end_time AND end_time > NEW.start_time"
+            f"{' AND id != NEW.id' if exclude_self else ''});"
+        )
+    return f"CREATE TRIGGER {name} BEFORE {event_clause} ON show BEGIN {' '.join(checks)} END"
+
+
+SQLITE_TRIGGERS = (
+    _sqlite_trigger('show_no_overlap_bi', 'INSERT', False),
+    _sqlite_trigger('show_no_overlap_bu', 'UPDATE OF venue_id, artist_id, start_time, end_time', True),
+)
+
+POSTGRES_CONSTRAINTS = tuple(
+    f"ALTER TABLE show ADD CONSTRAINT {constraint} EXCLUDE USING gist "
+    f"({side}_id WITH =, tsrange(start_time, end_time) WITH &&)"
+    for constraint, side in CONSTRAINTS.items()
+)
+
+event.listen(
+    db.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'),
+)
+for _statement in POSTGRES_CONSTRAINTS:
+    event.listen(Show.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+for _statement in SQLITE_TRIGGERS:
+    event.listen(Show.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
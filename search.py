@@ -0,0 +1,140 @@
+from flask import current_app
+from sqlalchemy import DDL, event, func, literal_column, table, column
+from sqlalchemy.engine import make_url
+
+from models import db, Venue, Artist
+
+
+# models whose name column gets a search index
+SEARCHABLE = (Venue, Artist)
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+#----------------------------------------------------------------------------#
+# Backends.
+#----------------------------------------------------------------------------#
+
+class LikeSearch:
+    """Case-insensitive substring search; works everywhere but scans the table."""
+
+    name = 'like'
+
+    def query(self, model, term):
+        return db.session.query(
+            model.id, model.name, model.upcoming_shows_count, func.count().over().label('total')
+        ).filter(
+            model.name.ilike(_like_pattern(term), escape='\\')
+        ).order_by(model.name, model.id)
+
+    def search(self, model, term, limit):
+        """Matching (id, name, upcoming_shows_count) rows, best first, and the total match count.
+
+        The total comes from a window function, so it costs no extra query.
+        """
+        rows = self.query(model, term).limit(limit).all()
+        return rows, rows[0].total if rows else 0
+
+
+class TrigramSearch(LikeSearch):
+    """Postgres substring search served by a pg_trgm GIN index, ranked by similarity."""
+
+    name = 'trigram'
+
+    def query(self, model, term):
+        return db.session.query(
+            model.id, model.name, model.upcoming_shows_count, func.count().over().label('total')
+        ).filter(
+            model.name.ilike(_like_pattern(term), escape='\\')
+        ).order_by(func.similarity(model.name, term).desc(), model.name, model.id)
+
+
+class FullTextSearch(LikeSearch):
+    """Postgres word search over a tsvector expression index, ranked by ts_rank."""
+
+    name = 'fulltext'
+
+    def query(self, model, term):
+        document = func.to_tsvector(literal_column("'simple'"), func.coalesce(model.name, ''))
+        tsquery = func.plainto_tsquery(literal_column("'simple'"), term)
+        return db.session.query(
+            model.id, model.name, model.upcoming_shows_count, func.count().over().label('total')
+        ).filter(
+            document.op('@@')(tsquery)
+        ).order_by(func.ts_rank(document, tsquery).desc(), model.name, model.id)
+
+
+class Fts5Search(LikeSearch):
+    """SQLite substring search over an FTS5 trigram table, ranked by bm25."""
+
+    name = 'fts5'
+
+    def query(self, model, term):
+        # the trigram tokenizer cannot match anything shorter than three characters
+        if len(term) < 3:
+            return super().query(model, term)
+
+        fts = table(f'{model.__tablename__}_fts', column('rowid'), column('rank'))
+        match = '"' + term.replace('"', '""') + '"'
+        return db.session.query(
+            model.id, model.name, model.upcoming_shows_count, func.count().over().label('total')
+        ).join(
+            fts, fts.c.rowid == model.id
+        ).filter(
+            literal_column(fts.name).op('MATCH')(match)
+        ).order_by(fts.c.rank, model.id)
+
+
+BACKENDS = {backend.name: backend for backend in (LikeSearch, TrigramSearch, FullTextSearch, Fts5Search)}
+
+
+def setup_search(app):
+    """Pick the search backend named by SEARCH_BACKEND, or one that fits the database."""
+    name = app.config.get('SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        dialect = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+        name = {'postgresql': 'trigram', 'sqlite': 'fts5'}.get(dialect, 'like')
+    app.extensions['search'] = BACKENDS[name]()
+
+
+def search(model, term):
+    backend = current_app.extensions['search']
+    return backend.search(model, term, current_app.config['SEARCH_RESULTS_LIMIT'])
+
+
+#----------------------------------------------------------------------------#
+# Indexes for databases built with db.create_all().
+# Migrated databases get the same objects from migration 5a1d7e3c9b20.
+#----------------------------------------------------------------------------#
+
+event.listen(
+    db.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
+
+for _model in SEARCHABLE:
+    _table = _model.__tablename__
+    for _statement in (
+        f"CREATE INDEX ix_{_table}_name_trgm ON {_table} USING gin (name gin_trgm_ops)",
+        f"CREATE INDEX ix_{_table}_name_tsv ON {_table} USING gin (to_tsvector('simple', coalesce(name, '')))",
+    ):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+    for _statement in (
+        f"CREATE VIRTUAL TABLE {_table}_fts USING fts5(name, content='{_table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {_table}_fts_ai AFTER INSERT ON {_table} BEGIN "
+        f"INSERT INTO {_table}_fts(rowid, name) VALUES (new.id, new.name); END",
+        f"CREATE TRIGGER {_table}_fts_ad AFTER DELETE ON {_table} BEGIN "
+        f"INSERT INTO {_table}_fts({_table}_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+        f"CREATE TRIGGER {_table}_fts_au AFTER UPDATE OF name ON {_table} BEGIN "
+        f"INSERT INTO {_table}_fts({_table}_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {_table}_fts(rowid, name) VALUES (new.id, new.name); END",
+    ):
+        event.listen(_model.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+    event.listen(
+        _model.__table__, 'before_drop',
+        DDL(f'DROP TABLE IF EXISTS {_table}_fts').execute_if(dialect='sqlite'),
+    )
@@ -0,0 +1,16 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data):
+    """JSON-encode `data` to bytes, datetimes as ISO 8601.
+
+    Uses orjson when it is installed; it is several times faster than json.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, default=lambda value: value.isoformat()).encode()
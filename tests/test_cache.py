@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from cache import cache, SimpleCache
+from clock import Clock
+from models import db, Venue, Artist, Show
+
+
+VENUE_FORM = {
+    'name': 'The Hall', 'city': 'San Francisco', 'state': 'CA', 'address': '1 Main Street',
+    'phone': '', 'image_link': '', 'facebook_link': 'https://www.facebook.com/thehall',
+    'website_link': '', 'seeking_description': '',
+}
+ARTIST_FORM = {
+    'name': 'The Band', 'city': 'San Francisco', 'state': 'CA', 'phone': '', 'image_link': '',
+    'facebook_link': 'https://www.facebook.com/theband', 'website_link': '', 'seeking_description': '',
+}
+
+
+@pytest.fixture
+def page_cache():
+    # conftest turns the page cache off; these tests need one, as a worker has
+    backend = cache.backend
+    cache.backend = SimpleCache()
+    yield cache
+    cache.backend = backend
+
+
+def add_venue_and_artist(app):
+    with app.app_context():
+        # as the edit forms post them, so an edit of the genres alone changes nothing else
+        db.session.add(Venue(**VENUE_FORM, genres=['Jazz'], seeking_talent=False))
+        db.session.add(Artist(**ARTIST_FORM, genres=['Jazz'], seeking_venue=False))
+        db.session.commit()
+
+
+def test_editing_only_genres_changes_the_etag(app, client):
+    add_venue_and_artist(app)
+    for path, form in (('/venues/1', VENUE_FORM), ('/artists/1', ARTIST_FORM)):
+        etag = client.get(path).headers['ETag']
+        assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+
+        client.post(f'{path}/edit', data=dict(form, genres=['Folk']))
+        response = client.get(path, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert 'Folk' in response.get_data(as_text=True)
+
+
+def test_a_cached_page_is_not_served_under_a_newer_etag(app, client, page_cache):
+    add_venue_and_artist(app)
+    client.get('/venues/1')
+    with app.app_context():
+        # edited through another worker: this worker's cache is never invalidated
+        db.session.get(Venue, 1).name = 'The New Hall'
+        db.session.commit()
+    response = client.get('/venues/1')
+    assert 'The New Hall' in response.get_data(as_text=True)
+    assert client.get('/venues/1', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_a_show_starting_changes_the_etag(app, client):
+    add_venue_and_artist(app)
+    start = datetime(2030, 6, 1, 20, 0)
+    with app.app_context():
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=start, end_time=start + timedelta(hours=2)))
+        db.session.commit()
+    for path in ('/venues/1', '/artists/1'):
+        app.extensions['clock'] = Clock(frozen=start - timedelta(hours=1))
+        etag = client.get(path).headers['ETag']
+        assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+
+        # no write happens, only time passes
+        app.extensions['clock'] = Clock(frozen=start + timedelta(hours=1))
+        response = client.get(path, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert '1 Past Show<' in response.get_data(as_text=True)
+
+
+def add_show(app, start=datetime(2031, 5, 1, 20, 0)):
+    with app.app_context():
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=start, end_time=start + timedelta(hours=2)))
+        db.session.commit()
+
+
+def get_all(client, paths):
+    return {path: client.get(path).get_data(as_text=True) for path in paths}
+
+
+@pytest.mark.parametrize('path, form, paths', [
+    ('/venues/1', VENUE_FORM, ('/venues', '/venues/1', '/artists/1', '/shows')),
+    ('/artists/1', ARTIST_FORM, ('/artists', '/artists/1', '/venues/1', '/shows')),
+])
+def test_an_edit_refreshes_the_listing_and_both_counterparts(app, client, page_cache, path, form, paths):
+    add_venue_and_artist(app)
+    add_show(app)
+    get_all(client, paths)
+    hits = page_cache.hits
+    assert get_all(client, paths) and page_cache.hits == hits + len(paths)
+
+    client.post(f'{path}/edit', data=dict(form, name='Renamed', genres=['Jazz']))
+    for page, body in get_all(client, paths).items():
+        assert 'Renamed' in body, page
+
+
+def test_a_new_show_refreshes_the_listing_and_both_counterparts(app, client, page_cache):
+    add_venue_and_artist(app)
+    paths = ('/venues/1', '/artists/1', '/shows')
+    before = get_all(client, paths)
+    assert 'The Band' not in before['/venues/1'] + before['/shows']
+
+    client.post('/shows/create', data={'venue_id': '1', 'artist_id': '1',
+                                       'start_time': '2031-05-01 20:00:00', 'duration': '120'})
+    after = get_all(client, paths)
+    assert 'The Band' in after['/venues/1'] and 'The Hall' in after['/artists/1'] and 'The Band' in after['/shows']
+
+
+def test_invalidate_cache_is_refused_for_a_per_process_cache(app, page_cache):
+    result = app.test_cli_runner().invoke(args=['fyyur', 'invalidate-cache'])
+    assert result.exit_code == 1
+    assert 'CACHE_BACKEND is simple' in result.output
+
+
+def test_invalidate_cache_drops_shared_pages(app, client, page_cache):
+    class SharedCache(SimpleCache):
+        shared = True
+
+    page_cache.backend = SharedCache()
+    add_venue_and_artist(app)
+    client.get('/venues')
+    with app.app_context():
+        # edited by hand, so no view invalidated anything
+        db.session.get(Venue, 1).name = 'The New Hall'
+        db.session.commit()
+    assert 'The New Hall' not in client.get('/venues').get_data(as_text=True)
+
+    result = app.test_cli_runner().invoke(args=['fyyur', 'invalidate-cache', 'venues'])
+    assert result.exit_code == 0, result.output
+    assert 'The New Hall' in client.get('/venues').get_data(as_text=True)
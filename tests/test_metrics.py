@@ -0,0 +1,56 @@
+import asyncio
+import os
+import runpy
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from asgi import create_asgi_app
+from models import db, Venue
+
+# an optional dependency, as in metrics.py
+prometheus_client = pytest.importorskip('prometheus_client')
+from prometheus_client import REGISTRY, multiprocess
+
+
+def requests_served(route):
+    return REGISTRY.get_sample_value(
+        'fyyur_requests_total', {'method': 'GET', 'route': route, 'status': '200'}
+    ) or 0
+
+
+def test_async_views_are_labelled_by_their_route(tmp_path):
+    asgi_app = create_asgi_app('sqlite:///' + str(tmp_path / 'fyyur.db'))
+    with asgi_app.app.app_context():
+        db.create_all()
+        db.session.add(Venue(name='The Hall', city='San Francisco', state='CA', address='1 Main Street'))
+        db.session.commit()
+        db.session.remove()
+    before = requests_served('/venues/<int:venue_id>')
+
+    async def get():
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi_app),
+                                         base_url='http://testserver') as client:
+                return await client.get('/venues/1')
+        finally:
+            await asgi_app.engine.dispose()
+
+    assert asyncio.run(get()).status_code == 200
+    assert requests_served('/venues/<int:venue_id>') == before + 1
+    assert requests_served('unmatched') == 0
+
+
+@pytest.mark.parametrize('multiprocess_dir, marked', [(True, [1234]), (False, [])])
+def test_gunicorn_marks_dead_workers_for_multiprocess_metrics(monkeypatch, tmp_path, multiprocess_dir, marked):
+    if multiprocess_dir:
+        monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    else:
+        monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    dead = []
+    monkeypatch.setattr(multiprocess, 'mark_process_dead', dead.append)
+    hooks = runpy.run_path(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py'))
+
+    hooks['child_exit'](None, SimpleNamespace(pid=1234))
+    assert dead == marked
@@ -0,0 +1,77 @@
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from counters import recount_show_counters
+from models import db, Venue, Artist, Show
+
+
+def add_venues(app, count):
+    with app.app_context():
+        start = Venue.query.count()
+        db.session.add_all(
+            Venue(name=f'Venue {n}', city=f'City {n % 7}', state='CA', address=f'{n} Main Street')
+            for n in range(start, start + count)
+        )
+        db.session.commit()
+
+
+def add_shows(app, count):
+    """`count` more shows of artist 1 at venue 1, one a day, half of them past."""
+    with app.app_context():
+        if Venue.query.count() == 0:
+            db.session.add_all([Venue(name='The Hall', city='San Francisco', state='CA'),
+                                Artist(name='The Band', city='San Francisco', state='CA')])
+            db.session.flush()
+        start = Show.query.count()
+        first = datetime.now().replace(microsecond=0) - timedelta(days=count // 2)
+        db.session.add_all(
+            Show(venue_id=1, artist_id=1, start_time=first + timedelta(days=n, hours=start % 24),
+                 end_time=first + timedelta(days=n, hours=start % 24, minutes=30))
+            for n in range(count)
+        )
+        db.session.flush()
+        recount_show_counters([1], [1])
+        db.session.commit()
+
+
+def statements_run(app, client, path):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert client.get(path).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return len(statements)
+
+
+def queries_reported(response):
+    # the statement count instrumentation.py puts in Server-Timing
+    assert response.status_code == 200
+    return int(re.search(r'desc="(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+
+def test_venue_areas_statements_do_not_grow_with_venues(app, client):
+    add_venues(app, 20)
+    few = statements_run(app, client, '/venues')
+    add_venues(app, 180)
+    many = statements_run(app, client, '/venues')
+    assert few == many
+
+
+def test_detail_pages_stay_within_three_statements(app, client):
+    # over budget, the request fails with instrumentation.QueryBudgetExceeded
+    app.config['SQL_QUERY_BUDGET'] = 3
+    add_shows(app, 1)
+    one_show = [queries_reported(client.get(path)) for path in ('/venues/1', '/artists/1')]
+    add_shows(app, 499)
+    many_shows = [queries_reported(client.get(path)) for path in ('/venues/1', '/artists/1')]
+    assert one_show == many_shows
+    assert max(many_shows) <= 3
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION
+from scheduling import booking_conflict, clashes, free_slots
+
+
+START = datetime(2031, 5, 1, 20, 0)
+
+
+def add_venues_and_artists(app, count=2):
+    with app.app_context():
+        for i in range(1, count + 1):
+            db.session.add(Venue(name=f'Venue {i}', city='San Francisco', state='CA', address=f'{i} Main Street'))
+            db.session.add(Artist(name=f'Artist {i}', city='San Francisco', state='CA'))
+        db.session.commit()
+
+
+def post_show(client, venue_id=1, artist_id=1, start_time=START, duration='120'):
+    return client.post('/shows/create', data={
+        'venue_id': str(venue_id), 'artist_id': str(artist_id),
+        'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'), 'duration': duration,
+    })
+
+
+def test_a_show_without_a_duration_takes_the_default(app, client):
+    add_venues_and_artists(app)
+    assert post_show(client, duration='').status_code == 200
+    with app.app_context():
+        show = Show.query.one()
+        assert show.end_time - show.start_time == DEFAULT_SHOW_DURATION
+
+
+def test_an_out_of_range_duration_is_a_form_error(app, client):
+    add_venues_and_artists(app)
+    for duration in ('0', str(24 * 60 + 1), 'long'):
+        response = post_show(client, duration=duration)
+        assert response.status_code == 400
+        assert 'text-danger' in response.get_data(as_text=True)
+    with app.app_context():
+        assert Show.query.count() == 0
+
+
+def test_an_overlapping_show_is_rejected_for_the_venue_and_the_artist(app, client):
+    add_venues_and_artists(app)
+    post_show(client)
+    an_hour_later = START + timedelta(hours=1)
+
+    response = post_show(client, venue_id=1, artist_id=2, start_time=an_hour_later)
+    assert 'The venue is already booked at that time.' in response.get_data(as_text=True)
+    response = post_show(client, venue_id=2, artist_id=1, start_time=an_hour_later)
+    assert 'The artist is already booked at that time.' in response.get_data(as_text=True)
+    with app.app_context():
+        assert Show.query.count() == 1
+
+
+def test_back_to_back_shows_are_accepted(app, client):
+    add_venues_and_artists(app)
+    post_show(client)
+    two_hours_later = START + timedelta(minutes=120)
+
+    for venue_id, artist_id in ((1, 2), (2, 1)):
+        response = post_show(client, venue_id=venue_id, artist_id=artist_id, start_time=two_hours_later)
+        assert 'Show was successfully listed!' in response.get_data(as_text=True)
+    with app.app_context():
+        assert Show.query.count() == 3
+
+
+def test_the_database_rejects_a_double_booking(app):
+    add_venues_and_artists(app)
+    with app.app_context():
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=START, end_time=START + timedelta(hours=2)))
+        db.session.add(Show(venue_id=2, artist_id=2, start_time=START, end_time=START + timedelta(hours=2)))
+        db.session.commit()
+
+        # bypassing the views and clashes(): the trigger still refuses the insert
+        db.session.add(Show(venue_id=1, artist_id=2, start_time=START + timedelta(hours=1),
+                            end_time=START + timedelta(hours=3)))
+        with pytest.raises(IntegrityError) as error:
+            db.session.flush()
+        assert booking_conflict(error.value) == 'venue'
+        db.session.rollback()
+
+        # and an update that moves a show onto another one
+        Show.query.filter_by(venue_id=2).one().artist_id = 1
+        with pytest.raises(IntegrityError) as error:
+            db.session.flush()
+        assert booking_conflict(error.value) == 'artist'
+        db.session.rollback()
+
+
+def test_clashes_checks_booked_shows_and_earlier_rows(app):
+    add_venues_and_artists(app, count=3)
+    with app.app_context():
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=START, end_time=START + timedelta(hours=2)))
+        db.session.commit()
+
+        def row(venue_id, artist_id, hours):
+            start_time = START + timedelta(hours=hours)
+            return {'venue_id': venue_id, 'artist_id': artist_id,
+                    'start_time': start_time, 'end_time': start_time + timedelta(hours=2)}
+
+        assert clashes([
+            row(1, 2, 1),
+            row(2, 1, 1),
+            row(2, 2, 2),
+            row(3, 2, 3),
+            row(3, 3, 24),
+        ]) == [
+            'The venue is already booked at that time.',
+            'The artist is already booked at that time.',
+            None,
+            # clashes with the row before it, not with anything booked
+            'The artist is already booked at that time.',
+            None,
+        ]
+
+
+def test_free_slots_are_the_gaps_between_a_venues_shows(app):
+    add_venues_and_artists(app)
+    week_start = datetime(2031, 5, 5)
+    with app.app_context():
+        for venue_id, day in ((1, 0), (1, 2), (2, 1)):
+            start_time = week_start + timedelta(days=day, hours=20)
+            db.session.add(Show(venue_id=venue_id, artist_id=venue_id, start_time=start_time,
+                                end_time=start_time + timedelta(hours=2)))
+        db.session.commit()
+
+        assert free_slots(1, week_start) == [
+            (week_start, week_start + timedelta(hours=20)),
+            (week_start + timedelta(hours=22), week_start + timedelta(days=2, hours=20)),
+            (week_start + timedelta(days=2, hours=22), week_start + timedelta(days=7)),
+        ]
+        assert free_slots(1, week_start, min_length=timedelta(days=1)) == [
+            (week_start + timedelta(hours=22), week_start + timedelta(days=2, hours=20)),
+            (week_start + timedelta(days=2, hours=22), week_start + timedelta(days=7)),
+        ]
+
+
+def test_a_tour_books_every_date_but_the_clashing_one(app, client):
+    add_venues_and_artists(app)
+    with app.app_context():
+        db.session.add(Show(venue_id=1, artist_id=2, start_time=START, end_time=START + timedelta(hours=2)))
+        db.session.commit()
+
+    dates = [(1, START + timedelta(hours=1)), (2, START + timedelta(days=1)), (1, START + timedelta(days=2))]
+    form = {'artist_id': '1'}
+    for i, (venue_id, start_time) in enumerate(dates):
+        form.update({f'dates-{i}-venue_id': str(venue_id),
+                     f'dates-{i}-start_time': start_time.strftime('%Y-%m-%d %H:%M'),
+                     f'dates-{i}-duration': '120'})
+    body = client.post('/shows/tour', data=form).get_data(as_text=True)
+
+    assert '2 of 3 shows were listed.' in body
+    assert 'The venue is already booked at that time.' in body
+    with app.app_context():
+        booked = Show.query.filter_by(artist_id=1).order_by(Show.start_time)
+        assert [(show.venue_id, show.start_time) for show in booked] == dates[1:]